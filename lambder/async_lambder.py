@@ -0,0 +1,670 @@
+"""
+asyncio counterpart of Lambder, built on aiobotocore.
+
+Requires Python 3.7+ and the 'async' extra (pip install lambder[async]).
+The lambda, events, s3 and iam clients are created from one session and
+each keeps a pool of up to max_pool_connections connections, so many
+operations can be in flight from a single event loop:
+
+    async with AsyncLambder() as lambder:
+        entries = await lambder.list_events()
+"""
+import asyncio
+import contextlib
+import os
+
+import botocore.exceptions
+from aiobotocore.config import AioConfig
+from aiobotocore.session import get_session
+
+from .lambder import Entry, LambderBase
+
+
+class AsyncLambder(LambderBase):
+    # The coroutine counterpart of Lambder. Every method that talks to
+    # AWS is a coroutine; the helpers in LambderBase are shared.
+
+    def __init__(
+        self,
+        region=None,
+        profile=None,
+        max_pool_connections=50,
+        concurrency=20
+    ):
+        self._region = region
+        self._profile = profile
+        self.max_pool_connections = max_pool_connections
+        self.concurrency = concurrency
+        self._stack = None
+
+    # the configured region once the clients exist
+    @property
+    def region(self):
+        if self._stack is None:
+            return self._region
+        return self.awslambda.meta.region_name
+
+    @property
+    def profile(self):
+        return self._profile
+
+    async def __aenter__(self):
+        session = get_session()
+        if self._profile:
+            session.set_config_variable('profile', self._profile)
+        config = AioConfig(max_pool_connections=self.max_pool_connections)
+
+        def client(service):
+            return session.create_client(
+                service,
+                region_name=self._region,
+                config=config
+            )
+
+        stack = contextlib.AsyncExitStack()
+        create = stack.enter_async_context
+        try:
+            self.awslambda = await create(client('lambda'))
+            self.events = await create(client('events'))
+            self.s3 = await create(client('s3'))
+            self.iam = await create(client('iam'))
+        except BaseException:
+            # close the clients that did open
+            await stack.aclose()
+            raise
+        self._stack = stack
+        self._limit = asyncio.Semaphore(self.concurrency)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._stack.aclose()
+        self._stack = None
+
+    # Run coroutines concurrently, at most self.concurrency at a time.
+    # Results come back in order; the first failure cancels the rest.
+    async def _gather(self, coros):
+        async def limited(coro):
+            async with self._limit:
+                return await coro
+
+        tasks = [asyncio.ensure_future(limited(c)) for c in coros]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    # Run blocking local work (zipping, hashing, file reads) off the loop
+    async def _run_blocking(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, func, *args)
+
+    async def permit_rule_to_invoke_function(
+        self,
+        rule_arn,
+        function_name,
+        qualifier=None
+    ):
+        statement_id = function_name + "RulePermission"
+        params = {
+            'FunctionName': function_name,
+            'StatementId': statement_id,
+            'Action': 'lambda:InvokeFunction',
+            'Principal': 'events.amazonaws.com',
+            'SourceArn': rule_arn
+        }
+        if qualifier:
+            params['Qualifier'] = qualifier
+        await self.awslambda.add_permission(**params)
+
+    async def _target_arn(self, function_name):
+        try:
+            resp = await self.awslambda.get_alias(
+                FunctionName=function_name,
+                Name=self.ALIAS_NAME
+            )
+            return resp['AliasArn']
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] != 'ResourceNotFoundException':
+                raise
+
+        resp = await self.awslambda.get_function(
+            FunctionName=function_name
+        )
+        return resp['Configuration']['FunctionArn']
+
+    async def add_event(
+        self,
+        name,
+        function_name,
+        cron,
+        input_event={},
+        enabled=True,
+        input_json=None
+    ):
+        rule_name = self.NAME_PREFIX + name
+
+        if input_json is None:
+            input_json = self._dump_input(input_event)
+
+        # put-rule and the arn lookup don't depend on each other
+        resp, function_arn = await asyncio.gather(
+            self.events.put_rule(
+                Name=rule_name,
+                ScheduleExpression=cron,
+                State='ENABLED' if enabled else 'DISABLED'
+            ),
+            self._target_arn(function_name)
+        )
+        rule_arn = resp['RuleArn']
+        _, qualifier = self._parse_function_arn(function_arn)
+
+        try:
+            await self.permit_rule_to_invoke_function(
+                rule_arn,
+                function_name,
+                qualifier
+            )
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] != 'ResourceConflictException':
+                raise
+
+        # skip put-targets when the rule already sends this input
+        resp = await self.events.list_targets_by_rule(Rule=rule_name)
+        unchanged = any(
+            t['Id'] == name and t['Arn'] == function_arn and
+            t.get('Input') == input_json
+            for t in resp['Targets']
+        )
+        if unchanged:
+            return
+
+        await self.events.put_targets(
+            Rule=rule_name,
+            Targets=[
+                {
+                    'Id':    name,
+                    'Arn':   function_arn,
+                    'Input': input_json
+                }
+            ]
+        )
+
+    async def _rule_entry(self, rule):
+        resp = await self.events.list_targets_by_rule(
+            Rule=rule['Name']
+        )
+        targets = resp['Targets']
+        # assume only one target for now
+        function_name, _ = self._parse_function_arn(targets[0]['Arn'])
+        return Entry(
+            Name=targets[0]['Id'],
+            Cron=rule['ScheduleExpression'],
+            FunctionName=function_name,
+            Enabled=rule['State'] == 'ENABLED'
+        )
+
+    async def list_events(self):
+        paginator = self.events.get_paginator('list_rules')
+        rules = []
+        async for page in paginator.paginate(NamePrefix=self.NAME_PREFIX):
+            rules.extend(page['Rules'])
+
+        # look up every rule's target concurrently
+        return await self._gather(self._rule_entry(r) for r in rules)
+
+    async def delete_event(self, name):
+        rule_name = self.NAME_PREFIX + name
+
+        resp = await self.events.list_targets_by_rule(
+            Rule=rule_name
+        )
+        targets = resp['Targets']
+        # assume only one target for now
+        function_name, qualifier = self._parse_function_arn(targets[0]['Arn'])
+        params = {
+            'FunctionName': function_name,
+            'StatementId': function_name + "RulePermission"
+        }
+        if qualifier:
+            params['Qualifier'] = qualifier
+
+        await asyncio.gather(
+            self.events.remove_targets(Rule=rule_name, Ids=[name]),
+            self.awslambda.remove_permission(**params)
+        )
+
+        # the rule can only go once its targets are gone
+        await self.events.delete_rule(
+            Name=rule_name
+        )
+
+    async def disable_event(self, name):
+        await self.events.disable_rule(
+            Name=self.NAME_PREFIX + name
+        )
+
+    async def enable_event(self, name):
+        await self.events.enable_rule(
+            Name=self.NAME_PREFIX + name
+        )
+
+    async def load_events(self, data):
+        entries = self._prepare_events(data)
+        await self._check_s3_inputs(entries)
+        await self._gather(
+            self.add_event(
+                name=entry['name'],
+                cron=entry['cron'],
+                function_name=entry['function_name'],
+                enabled=entry['enabled'],
+                input_json=entry['input_json']
+            )
+            for entry in entries
+        )
+
+    async def _check_s3_inputs(self, entries):
+        async def exists(url):
+            bucket, key = self._parse_s3_url(url)
+            try:
+                await self.s3.head_object(Bucket=bucket, Key=key)
+            except botocore.exceptions.ClientError as e:
+                if not self._object_missing(e):
+                    raise
+                return False
+            return True
+
+        urls = sorted(set(e['input_s3'] for e in entries if e['input_s3']))
+        found = await self._gather(exists(url) for url in urls)
+        missing = [url for url, ok in zip(urls, found) if not ok]
+        if missing:
+            raise ValueError(
+                'input_s3 objects not found:\n  ' + '\n  '.join(missing)
+            )
+
+    async def _s3_cp(self, src, dest_bucket, dest_key):
+        body = await self._run_blocking(self._read_bytes, src)
+        await self.s3.put_object(
+            Bucket=dest_bucket,
+            Key=dest_key,
+            Body=body
+        )
+
+    def _read_bytes(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    async def _s3_copy(self, src_bucket, key, dest_bucket):
+        await self.s3.copy_object(
+            CopySource={'Bucket': src_bucket, 'Key': key},
+            Bucket=dest_bucket,
+            Key=key
+        )
+
+    async def _s3_rm(self, bucket, key):
+        await self.s3.delete_object(Bucket=bucket, Key=key)
+
+    async def _s3_rm_prefix(self, bucket, prefix):
+        paginator = self.s3.get_paginator('list_objects_v2')
+        async for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            keys = [{'Key': o['Key']} for o in page.get('Contents', [])]
+            if keys:
+                await self.s3.delete_objects(
+                    Bucket=bucket,
+                    Delete={'Objects': keys}
+                )
+
+    # Returns the role arn, creating the role if it does not exist
+    async def _create_lambda_role(self, role_name):
+        try:
+            resp = await self.iam.get_role(RoleName=role_name)
+            return resp['Role']['Arn']
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] != 'NoSuchEntity':
+                raise
+
+        resp = await self.iam.create_role(
+            RoleName=role_name,
+            AssumeRolePolicyDocument=self._trust_policy()
+        )
+        return resp['Role']['Arn']
+
+    async def _delete_lambda_role(self, name):
+        role_name = self._role_name(name)
+        deletes = [
+            (self.iam.delete_role_policy, {
+                'RoleName': role_name,
+                'PolicyName': self._policy_name(name)
+            }),
+            (self.iam.delete_role, {'RoleName': role_name})
+        ]
+        # the policy has to go before the role, either may be missing
+        for delete, params in deletes:
+            try:
+                await delete(**params)
+            except botocore.exceptions.ClientError as e:
+                if e.response['Error']['Code'] != 'NoSuchEntity':
+                    raise
+
+    async def _put_role_policy(self, role_name, policy_name, policy_doc):
+        await self.iam.put_role_policy(
+            RoleName=role_name,
+            PolicyName=policy_name,
+            PolicyDocument=policy_doc
+        )
+
+    async def _attach_vpc_policy(self, role_name):
+        await self.iam.attach_role_policy(
+            RoleName=role_name,
+            PolicyArn=self.VPC_POLICY_ARN
+        )
+
+    async def _lambda_exists(self, name):
+        try:
+            await self.awslambda.get_function(
+                FunctionName=self._long_name(name)
+            )
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] == 'ResourceNotFoundException':
+                return False
+            raise
+        return True
+
+    async def _update_lambda(
+        self,
+        name,
+        bucket,
+        key,
+        timeout,
+        memory,
+        description,
+        vpc_config
+    ):
+        await self.update_code(name, bucket, key)
+        resp = await self.awslambda.update_function_configuration(
+            FunctionName=self._long_name(name),
+            Timeout=timeout,
+            MemorySize=memory,
+            Description=description,
+            VpcConfig=vpc_config
+        )
+        await self._wait_for_update(name)
+        resp = await self.awslambda.publish_version(
+            FunctionName=self._long_name(name),
+            CodeSha256=resp['CodeSha256']
+        )
+        return resp['Version']
+
+    async def _create_lambda(
+        self,
+        name,
+        bucket,
+        key,
+        role_arn,
+        timeout,
+        memory,
+        description,
+        vpc_config
+    ):
+        resp = await self.awslambda.create_function(
+            FunctionName=self._long_name(name),
+            Runtime='python2.7',
+            Role=role_arn,
+            Handler="{}.handler".format(name),
+            Code={
+                'S3Bucket': bucket,
+                'S3Key': key
+            },
+            Timeout=timeout,
+            MemorySize=memory,
+            Description=description,
+            VpcConfig=vpc_config,
+            Publish=True
+        )
+        return resp['Version']
+
+    async def _wait_for_update(self, name):
+        waiter = self.awslambda.get_waiter('function_updated')
+        await waiter.wait(FunctionName=self._long_name(name))
+
+    async def _set_alias(self, name, version):
+        try:
+            resp = await self.awslambda.update_alias(
+                FunctionName=self._long_name(name),
+                Name=self.ALIAS_NAME,
+                FunctionVersion=version
+            )
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] != 'ResourceNotFoundException':
+                raise
+            resp = await self.awslambda.create_alias(
+                FunctionName=self._long_name(name),
+                Name=self.ALIAS_NAME,
+                FunctionVersion=version
+            )
+        return resp['AliasArn']
+
+    async def _retarget_events(self, alias_arn):
+        function_name, _ = self._parse_function_arn(alias_arn)
+        function_arn = alias_arn.rsplit(':', 1)[0]
+
+        rule_names = []
+        params = {'TargetArn': function_arn}
+        while True:
+            resp = await self.events.list_rule_names_by_target(**params)
+            rule_names.extend(
+                r for r in resp['RuleNames']
+                if r.startswith(self.NAME_PREFIX)
+            )
+            if not resp.get('NextToken'):
+                break
+            params['NextToken'] = resp['NextToken']
+
+        async def retarget(rule_name):
+            resp = await self.events.describe_rule(Name=rule_name)
+            try:
+                await self.permit_rule_to_invoke_function(
+                    resp['Arn'],
+                    function_name,
+                    self.ALIAS_NAME
+                )
+            except botocore.exceptions.ClientError as e:
+                if e.response['Error']['Code'] != 'ResourceConflictException':
+                    raise
+
+            resp = await self.events.list_targets_by_rule(Rule=rule_name)
+            targets = [
+                dict(t, Arn=alias_arn) for t in resp['Targets']
+                if t['Arn'] == function_arn
+            ]
+            if targets:
+                await self.events.put_targets(Rule=rule_name, Targets=targets)
+
+        await self._gather(retarget(r) for r in rule_names)
+        return rule_names
+
+    async def _get_alias_version(self, name):
+        resp = await self.awslambda.get_alias(
+            FunctionName=self._long_name(name),
+            Name=self.ALIAS_NAME
+        )
+        return resp['FunctionVersion']
+
+    async def _list_versions(self, name):
+        paginator = self.awslambda.get_paginator('list_versions_by_function')
+        versions = []
+        pages = paginator.paginate(FunctionName=self._long_name(name))
+        async for page in pages:
+            for v in page['Versions']:
+                if v['Version'] != '$LATEST':
+                    versions.append(int(v['Version']))
+        return sorted(versions)
+
+    async def _delete_lambda(self, name):
+        try:
+            await self.awslambda.delete_function(
+                FunctionName=self._long_name(name)
+            )
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] != 'ResourceNotFoundException':
+                raise
+
+    async def deploy_function(
+        self,
+        name,
+        bucket,
+        timeout,
+        memory,
+        description,
+        vpc_config,
+        prune=None
+    ):
+        role_name = self._role_name(name)
+        policy_file = os.path.join('iam', 'policy.json')
+
+        # packaging, the policy read and the role/function lookups are
+        # independent of each other
+        results = await asyncio.gather(
+            self._run_blocking(self._package, name, prune),
+            self._run_blocking(self._read_bytes, policy_file),
+            self._create_lambda_role(role_name),
+            self._lambda_exists(name),
+            return_exceptions=True
+        )
+        errors = [r for r in results if isinstance(r, BaseException)]
+        if errors:
+            # don't leave the zipfile behind if something else failed
+            if not isinstance(results[0], BaseException):
+                os.remove(results[0][0])
+            raise errors[0]
+        (zfile, digest), policy_doc, role_arn, exists = results
+        s3_key = self._s3_key(name, digest)
+
+        try:
+            uploads = [
+                self._s3_cp(zfile, bucket, s3_key),
+                self._put_role_policy(
+                    role_name,
+                    self._policy_name(name),
+                    policy_doc.decode('utf-8')
+                )
+            ]
+            if vpc_config:
+                uploads.append(self._attach_vpc_policy(role_name))
+            await asyncio.gather(*uploads)
+        finally:
+            os.remove(zfile)
+
+        timeout_i = int(timeout)
+        if exists:
+            version = await self._update_lambda(
+                name,
+                bucket,
+                s3_key,
+                timeout_i,
+                memory,
+                description,
+                vpc_config
+            )
+        else:
+            await asyncio.sleep(5)  # wait for role to be created
+            version = await self._create_lambda(
+                name,
+                bucket,
+                s3_key,
+                role_arn,
+                timeout_i,
+                memory,
+                description,
+                vpc_config
+            )
+
+        alias_arn = await self._set_alias(name, version)
+        await self._retarget_events(alias_arn)
+        return version
+
+    async def _upload_package(self, name, bucket, prune=None):
+        zfile, digest = await self._run_blocking(self._package, name, prune)
+        s3_key = self._s3_key(name, digest)
+        try:
+            await self._s3_cp(zfile, bucket, s3_key)
+        finally:
+            os.remove(zfile)
+        return s3_key
+
+    # Returns the role arn
+    async def deploy_policy(self, name):
+        role_name = self._role_name(name)
+        policy_file = os.path.join('iam', 'policy.json')
+        role_arn, policy_doc = await asyncio.gather(
+            self._create_lambda_role(role_name),
+            self._run_blocking(self._read_bytes, policy_file)
+        )
+        await self._put_role_policy(
+            role_name,
+            self._policy_name(name),
+            policy_doc.decode('utf-8')
+        )
+        return role_arn
+
+    async def update_code(self, name, bucket, s3_key=None, prune=None):
+        if s3_key is None:
+            s3_key = await self._upload_package(name, bucket, prune)
+
+        resp = await self.awslambda.update_function_code(
+            FunctionName=self._long_name(name),
+            S3Bucket=bucket,
+            S3Key=s3_key
+        )
+        await self._wait_for_update(name)
+        return resp['CodeSha256']
+
+    async def rollback_function(self, name, version=None):
+        if version is None:
+            current, versions = await asyncio.gather(
+                self._get_alias_version(name),
+                self._list_versions(name)
+            )
+            older = [v for v in versions if v < int(current)]
+            if not older:
+                raise ValueError(
+                    'no version older than {} to roll back to'.format(current)
+                )
+            version = older[-1]
+
+        alias_arn = await self._set_alias(name, str(version))
+        await self._retarget_events(alias_arn)
+        return str(version)
+
+    async def list_functions(self):
+        paginator = self.awslambda.get_paginator('list_functions')
+        functions = []
+        async for page in paginator.paginate():
+            functions.extend(
+                f for f in page['Functions']
+                if f['FunctionName'].startswith(self.NAME_PREFIX)
+            )
+        return functions
+
+    async def delete_function(self, name, bucket):
+        await asyncio.gather(
+            self._delete_lambda(name),
+            self._delete_lambda_role(name),
+            self._s3_rm_prefix(bucket, self._s3_prefix(name)),
+            self._s3_rm(bucket, self._legacy_s3_key(name))
+        )
+
+    async def invoke_function(self, name, input_event):
+        payload = b'{}'  # default to empty event
+
+        if input_event:
+            payload = await self._run_blocking(self._read_bytes, input_event)
+
+        resp = await self.awslambda.invoke(
+            FunctionName=self._long_name(name),
+            InvocationType='RequestResponse',
+            Payload=payload
+        )
+        return await resp['Payload'].read()
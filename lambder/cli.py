@@ -1,14 +1,49 @@
 import click
 import json
 import os
-from lambder import Lambder, Entry
+import time
+from lambder import Lambder, LambderGroup, Entry, Watcher
 
-lambder = Lambder()
+lambder = LambderGroup()
+
+
+def split_list(value):
+    return value.split(',') if value else None
+
+
+# Echo every target's output, prefixed with its profile/region when the
+# command was fanned out, and fail once all targets have reported.
+def echo_results(results, lines=lambda value: []):
+    failures = 0
+    for result in results:
+        if result.error and not lambder.is_fanned_out:
+            raise result.error
+
+        prefix = result.label + "\t" if lambder.is_fanned_out else ''
+        if result.error:
+            failures += 1
+            click.echo(prefix + 'error: ' + str(result.error), err=True)
+        else:
+            for line in lines(result.value):
+                click.echo(prefix + line)
+
+    if failures:
+        raise click.ClickException(
+            '{} of {} targets failed'.format(failures, len(results))
+        )
 
 
 @click.group()
-def cli():
-    pass
+@click.option(
+    '--regions',
+    help='comma-separated list of regions to run the command in'
+)
+@click.option(
+    '--profiles',
+    help='comma-separated list of AWS profiles to run the command as'
+)
+def cli(regions, profiles):
+    lambder.configure(split_list(regions), split_list(profiles))
 
 
 @cli.group()
@@ -21,9 +56,8 @@ def events():
 @events.command()
 def list():
     """ List all events """
-    entries = lambder.list_events()
-    for e in entries:
-        click.echo(str(e))
+    results = lambder.run('list_events')
+    echo_results(results, lambda entries: [str(e) for e in entries])
 
 
 # lambder events add
@@ -33,7 +67,13 @@ def list():
 @click.option("--cron", help='cron expression')
 def add(name, function_name, cron):
     """ Create an event """
-    lambder.add_event(name=name, function_name=function_name, cron=cron)
+    results = lambder.run(
+        'add_event',
+        name=name,
+        function_name=function_name,
+        cron=cron
+    )
+    echo_results(results)
 
 
 # lambder events rm
@@ -41,7 +81,7 @@ def add(name, function_name, cron):
 @click.option('--name', help='event to remove')
 def rm(name):
     """ Remove an existing entry """
-    lambder.delete_event(name)
+    echo_results(lambder.run('delete_event', name))
 
 
 # lambder events disable
@@ -49,7 +89,7 @@ def rm(name):
 @click.option('--name', help='event to disable')
 def disable(name):
     """ Disable an event """
-    lambder.disable_event(name)
+    echo_results(lambder.run('disable_event', name))
 
 
 # lambder events enable
@@ -57,7 +97,7 @@ def disable(name):
 @click.option('--name', help='event to enable')
 def enable(name):
     """ Enable a disabled event """
-    lambder.enable_event(name)
+    echo_results(lambder.run('enable_event', name))
 
 
 # lambder events load
@@ -67,7 +107,7 @@ def load(file):
     """ Load events from a json file """
     with open(file, 'r') as f:
         contents = f.read()
-    lambder.load_events(contents)
+    echo_results(lambder.run('load_events', contents))
 
 
 class FunctionConfig:
@@ -82,11 +122,14 @@ class FunctionConfig:
         self.description = config['description']
         self.subnet_ids = None
         self.security_group_ids = None
+        self.prune = None
 
         if 'subnet_ids' in config:
             self.subnet_ids = config['subnet_ids']
         if 'security_group_ids' in config:
             self.security_group_ids = config['security_group_ids']
+        if 'prune' in config:
+            self.prune = config['prune']
 
 
 @cli.group()
@@ -104,7 +147,17 @@ def functions(context):
 @functions.command()
 def list():
     """ List lambder functions """
-    functions = lambder.list_functions()
+    results = lambder.run('list_functions')
+
+    # merge every target's functions into one list
+    functions = []
+    for result in results:
+        for function in result.value or []:
+            if lambder.is_fanned_out:
+                function['Profile'] = result.lambder.profile
+                function['Region'] = result.lambder.region
+            functions.append(function)
+
     output = json.dumps(
         functions,
         sort_keys=True,
@@ -112,6 +165,7 @@ def list():
         separators=(',', ':')
     )
     click.echo(output)
+    echo_results([r for r in results if r.error])
 
 
 # lambder functions new
@@ -152,7 +206,7 @@ def new(
     if security_group_ids:
         config['security_group_ids'] = security_group_ids
 
-    lambder.create_project(name, bucket, config)
+    lambder.members[0].create_project(name, bucket, config)
 
 
 # lambder functions deploy
@@ -167,6 +221,16 @@ def new(
     '--security-group-ids',
     help='comma-separated list of VPC security group ids'
 )
+@click.option(
+    '--prune',
+    type=click.Choice(sorted(Lambder.PRUNE_PROFILES)),
+    help='leave files the function does not need out of the zipfile'
+)
+@click.option(
+    '--watch',
+    is_flag=True,
+    help='keep running and push code or policy changes as they are saved'
+)
 @click.pass_obj
 def deploy(
     config,
@@ -176,7 +240,9 @@ def deploy(
     memory,
     description,
     subnet_ids,
-    security_group_ids
+    security_group_ids,
+    prune,
+    watch
 ):
     """ Deploy/Update a function from a project directory """
     # options should override config if it is there
@@ -187,6 +253,22 @@ def deploy(
     mydescription = description or config.description
     mysubnet_ids = subnet_ids or config.subnet_ids
     mysecurity_group_ids = security_group_ids or config.security_group_ids
+    myprune = prune or config.prune
+
+    # --prune is checked by click, lambder.json is not
+    if myprune and myprune not in Lambder.PRUNE_PROFILES:
+        raise click.BadParameter(
+            'invalid choice: {}. (choose from {})'.format(
+                myprune,
+                ', '.join(sorted(Lambder.PRUNE_PROFILES))
+            ),
+            param_hint='"prune" in lambder.json'
+        )
+
+    try:
+        lambder.members[0]._lambda_dir(myname)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--name')
 
     vpc_config = {}
     if mysubnet_ids and mysecurity_group_ids:
@@ -195,14 +277,155 @@ def deploy(
             'SecurityGroupIds': mysecurity_group_ids.split(',')
         }
 
+    try:
+        lambder.check_bucket(mybucket)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--bucket')
+
     click.echo('Deploying {} to {}'.format(myname, mybucket))
-    lambder.deploy_function(
+    results = lambder.deploy_function(
         myname,
         mybucket,
         mytimeout,
         mymemory,
         mydescription,
-        vpc_config
+        vpc_config,
+        myprune
+    )
+    echo_results(
+        results,
+        lambda version: ['{} is live at version {}'.format(myname, version)]
+    )
+
+    if watch:
+        watch_function(myname, mybucket, myprune)
+
+
+# Redeploy whatever changed under lambda/<name> or iam/policy.json until
+# interrupted. Code changes update $LATEST only, no version is published.
+def watch_function(name, bucket, prune):
+    code_dir = os.path.join('lambda', name)
+    policy_file = os.path.join('iam', 'policy.json')
+
+    # changes to files the package leaves out don't need a redeploy
+    exclude = lambder.members[0]._prune_patterns(prune) if prune else ()
+    watcher = Watcher([code_dir, policy_file], exclude)
+
+    click.echo('Watching {} and {}, ctrl-c to stop'.format(
+        code_dir,
+        policy_file
+    ))
+    try:
+        for changed in watcher.changes():
+            start = time.time()
+            try:
+                if code_dir in changed:
+                    echo_results(
+                        lambder.update_code(name, bucket, prune),
+                        lambda sha: ['updated code ' + sha]
+                    )
+                if policy_file in changed:
+                    echo_results(
+                        lambder.deploy_policy(name),
+                        lambda role: ['updated policy']
+                    )
+            except Exception as e:
+                click.echo('error: ' + str(e), err=True)
+                continue
+            click.echo('Redeployed {} in {:.2f}s'.format(
+                ', '.join(sorted(changed)),
+                time.time() - start
+            ))
+    except KeyboardInterrupt:
+        pass
+
+
+def format_size(size):
+    for unit in ['B', 'KB', 'MB']:
+        if size < 1024:
+            return '{:.1f} {}'.format(size, unit)
+        size /= 1024.0
+    return '{:.1f} GB'.format(size)
+
+
+# lambder functions analyze
+@functions.command()
+@click.option('--name', help='name of the function')
+@click.option(
+    '--prune',
+    type=click.Choice(sorted(Lambder.PRUNE_PROFILES)),
+    help='also show the zipfile size with this prune profile'
+)
+@click.option('--top', default=10, help='rows to show per breakdown')
+@click.pass_obj
+def analyze(config, name, prune, top):
+    """ Show what makes up a function's zipfile """
+    # options should override config if it is there
+    myname = name or config.name
+
+    try:
+        report = lambder.members[0].analyze_package(myname, prune)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--name')
+
+    click.echo('{} files, {} ({} zipped)'.format(
+        report['files'],
+        format_size(report['size']),
+        format_size(report['zipped'])
+    ))
+
+    breakdowns = [
+        ('By directory', report['by_dir']),
+        ('By file type', report['by_type']),
+        ('Prunable, by category', report['flagged']),
+    ]
+    for title, rows in breakdowns:
+        if not rows:
+            continue
+        click.echo('\n' + title)
+        ranked = sorted(rows.items(), key=lambda r: r[1][1], reverse=True)
+        for key, (count, size) in ranked[:top]:
+            click.echo('  {:<30} {:>6} files {:>10}'.format(
+                key,
+                count,
+                format_size(size)
+            ))
+
+    if report['duplicates']:
+        click.echo('\nDuplicate files')
+        for paths in report['duplicates'][:top]:
+            click.echo('  ' + ', '.join(paths))
+
+    click.echo('')
+    if isinstance(report['import_time'], float):
+        click.echo('Handler import time: {:.3f}s'.format(report['import_time']))
+    else:
+        click.echo('Handler import failed: ' + report['import_time'])
+
+    if prune:
+        click.echo('Zipped with --prune {}: {}'.format(
+            prune,
+            format_size(report['pruned_zipped'])
+        ))
+
+
+# lambder functions rollback
+@functions.command()
+@click.option('--name', help='name of the function')
+@click.option(
+    '--version',
+    help='version to make live, defaults to the previous version'
+)
+@click.pass_obj
+def rollback(config, name, version):
+    """ Point the live alias at an earlier version """
+    # options should override config if it is there
+    myname = name or config.name
+
+    results = lambder.run('rollback_function', myname, version)
+    echo_results(
+        results,
+        lambda version: ['{} is live at version {}'.format(myname, version)]
     )
 
 
@@ -218,7 +441,7 @@ def rm(config, name, bucket):
     mybucket = bucket or config.bucket
 
     click.echo('Deleting {} from {}'.format(myname, mybucket))
-    lambder.delete_function(myname, mybucket)
+    echo_results(lambder.delete_function(myname, mybucket))
 
 
 # lambder functions invoke
@@ -232,5 +455,5 @@ def invoke(config, name, input):
     myname = name or config.name
 
     click.echo('Invoking ' + myname)
-    output = lambder.invoke_function(myname, input)
-    click.echo(output)
+    results = lambder.run('invoke_function', myname, input)
+    echo_results(results, lambda output: [output.decode('utf-8')])
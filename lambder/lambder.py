@@ -1,8 +1,16 @@
 import boto3
-import botocore.session
+import collections
+import concurrent.futures
+import botocore.exceptions
+import fnmatch
+import hashlib
 import json
 from cookiecutter.main import cookiecutter
 import os
+import re
+import subprocess
+import sys
+import threading
 import zipfile
 import tempfile
 import time
@@ -38,23 +46,510 @@ class Entry:
         ])
 
 
-class Lambder:
+class LambderBase:
+    # Names, limits, packaging and event file handling shared by Lambder
+    # and AsyncLambder. Nothing here talks to AWS.
     NAME_PREFIX = 'Lambder-'
+    ALIAS_NAME = 'live'
+    VPC_POLICY_ARN = (
+        'arn:aws:iam::aws:policy/service-role/'
+        'AWSLambdaVPCAccessExecutionRole'
+    )
+
+    # CloudWatch Events limits, checked locally before loading events
+    MAX_RULE_NAME_LENGTH = 64
+    MAX_TARGET_ID_LENGTH = 64
+    MAX_SCHEDULE_LENGTH = 256
+    MAX_INPUT_LENGTH = 8192
+
+    # Files a lambda does not need at run time, as (category, top level
+    # only, patterns). Top level rules only look at the first component
+    # of a path, so 'tests' drops the project's own tests/ but leaves a
+    # vendored pkg/testing/ alone; the others match at any depth.
+    PRUNE_RULES = [
+        ('tests', True, ['tests', 'test']),
+        ('docs', True, ['docs', 'doc', 'examples', '*.md', '*.rst']),
+        ('caches', False, ['__pycache__', '*.pyc', '*.pyo']),
+        ('metadata', False, ['*.dist-info', '*.egg-info', '*.pyi']),
+        ('vendored-tests', False, ['tests', 'test', 'testing']),
+        ('vendored-docs', False, ['docs', 'doc', 'examples', '*.md', '*.rst']),
+    ]
+    PRUNE_PROFILES = {
+        'none': [],
+        'safe': ['tests', 'docs', 'caches'],
+        'strict': [
+            'tests',
+            'docs',
+            'caches',
+            'metadata',
+            'vendored-tests',
+            'vendored-docs'
+        ],
+    }
+
+    # seconds to wait for the handler module to import
+    IMPORT_TIMEOUT = 30
+
+    # Split a lambda arn into function name and qualifier, e.g.
+    # arn:aws:lambda:us-east-1:123456789012:function:foo      -> foo, None
+    # arn:aws:lambda:us-east-1:123456789012:function:foo:live -> foo, live
+    #
+    def _parse_function_arn(self, arn):
+        parts = arn.split(':')
+        qualifier = parts[7] if len(parts) > 7 else None
+        return parts[6], qualifier
+
+    # compact separators keep inputs well under the size limit
+    def _dump_input(self, input_event):
+        return json.dumps(input_event, sort_keys=True, separators=(',', ':'))
+
+    PLACEHOLDER = re.compile(r'\$\{(\w+)\}')
+
+    # Resolve every entry's input to its serialized form and check the
+    # result against the CloudWatch Events limits. An entry's input is
+    # one of:
+    #
+    #   "input_event": {...}              used as is
+    #   "input_template": "name",         a template from 'templates',
+    #   "input_vars": {...}               rendered with input_vars
+    #   "input_s3": "s3://bucket/key"     the event is a reference to an
+    #                                     S3 object the function fetches
+    #
+    # Raises ValueError listing every problem found.
+    def _prepare_events(self, data):
+        doc = json.loads(data)
+        templates = {}
+        if isinstance(doc, dict):
+            templates = doc.get('templates', {})
+            doc = doc.get('events', [])
+        if not isinstance(templates, dict):
+            raise ValueError('invalid events:\n  templates must be an object')
+        if not isinstance(doc, list):
+            raise ValueError('invalid events:\n  events must be a list')
+
+        errors = []
+        entries = []
+        for i, raw in enumerate(doc):
+            if not isinstance(raw, dict):
+                errors.append('#{}: event must be an object'.format(i))
+                continue
+
+            label = raw.get('name')
+            if not label or not self._is_string(label):
+                label = '#{}'.format(i)
+            try:
+                for field in ['name', 'cron', 'function_name']:
+                    if not self._is_string(raw[field]):
+                        raise ValueError(field + ' must be a string')
+                entry = {
+                    'name': raw['name'],
+                    'cron': raw['cron'],
+                    'function_name': raw['function_name'],
+                    'enabled': raw.get('enabled', True),
+                    'input_s3': raw.get('input_s3')
+                }
+                input_event = self._resolve_input(raw, templates)
+            except (KeyError, ValueError) as e:
+                errors.append('{}: {}'.format(label, self._error_text(e)))
+                continue
+
+            entry['input_json'] = self._dump_input(input_event)
+            errors.extend(
+                '{}: {}'.format(label, problem)
+                for problem in self._check_limits(entry)
+            )
+            entries.append(entry)
+
+        if errors:
+            raise ValueError(
+                'invalid events:\n  ' + '\n  '.join(errors)
+            )
+        return entries
+
+    def _is_string(self, value):
+        return isinstance(value, (type(u''), str))
+
+    def _error_text(self, error):
+        if isinstance(error, KeyError):
+            return 'missing {!r}'.format(error.args[0])
+        return str(error)
+
+    def _resolve_input(self, raw, templates):
+        if 'input_s3' in raw:
+            bucket, key = self._parse_s3_url(raw['input_s3'])
+            return {'input_s3': {'bucket': bucket, 'key': key}}
+
+        if 'input_template' in raw:
+            name = raw['input_template']
+            variables = raw.get('input_vars', {})
+            if not self._is_string(name):
+                raise ValueError('input_template must be a template name')
+            if name not in templates:
+                raise ValueError('unknown template ' + name)
+            if not isinstance(variables, dict):
+                raise ValueError('input_vars must be an object')
+            return self._render(templates[name], variables)
+
+        return raw.get('input_event', {})
+
+    # Substitute ${var} placeholders in every string of a template. A
+    # string that is exactly one placeholder takes the variable's value
+    # as is, so lists and objects can be spliced in. Inside a longer
+    # string, strings go in as they are and other values as JSON, e.g.
+    # "flag-${f}" becomes "flag-true". Any other '$' is left alone, so
+    # "$.detail" stays as it is.
+    def _render(self, template, variables):
+        if isinstance(template, dict):
+            return dict(
+                (k, self._render(v, variables)) for k, v in template.items()
+            )
+        if isinstance(template, list):
+            return [self._render(v, variables) for v in template]
+        if self._is_string(template):
+            for var in self.PLACEHOLDER.findall(template):
+                if var not in variables:
+                    raise ValueError('no value for ${' + var + '}')
+
+            whole = self.PLACEHOLDER.match(template.strip())
+            if whole and whole.group(0) == template.strip():
+                return variables[whole.group(1)]
+            return self.PLACEHOLDER.sub(
+                lambda m: self._render_text(variables[m.group(1)]),
+                template
+            )
+        return template
+
+    def _render_text(self, value):
+        if self._is_string(value):
+            return value
+        return self._dump_input(value)
+
+    def _parse_s3_url(self, url):
+        if not self._is_string(url) or not url.startswith('s3://') or '/' not in url[5:]:
+            raise ValueError('input_s3 must look like s3://bucket/key')
+        bucket, key = url[5:].split('/', 1)
+        return bucket, key
+
+    # head-object reports a missing key as a bare 404
+    def _object_missing(self, error):
+        code = error.response['Error']['Code']
+        return code in ('404', 'NoSuchKey', 'NotFound')
+
+    def _check_limits(self, entry):
+        problems = []
+        rule_name = self.NAME_PREFIX + entry['name']
+        if len(rule_name) > self.MAX_RULE_NAME_LENGTH:
+            problems.append('rule name {} is longer than {} characters'.format(
+                rule_name,
+                self.MAX_RULE_NAME_LENGTH
+            ))
+        if len(entry['name']) > self.MAX_TARGET_ID_LENGTH:
+            problems.append('name is longer than {} characters'.format(
+                self.MAX_TARGET_ID_LENGTH
+            ))
+        if len(entry['cron']) > self.MAX_SCHEDULE_LENGTH:
+            problems.append('cron is longer than {} characters'.format(
+                self.MAX_SCHEDULE_LENGTH
+            ))
+        if len(entry['input_json']) > self.MAX_INPUT_LENGTH:
+            problems.append(
+                'input is {} characters, the limit is {}; '
+                'consider input_s3'.format(
+                    len(entry['input_json']),
+                    self.MAX_INPUT_LENGTH
+                )
+            )
+        return problems
 
-    def __init__(self):
-        self.awslambda = boto3.client('lambda')
-        session = botocore.session.get_session()
-        self.events = session.create_client('events')
+    # Recursively zip path, creating a zipfile with contents
+    # relative to path.
+    # e.g. lambda/foo/foo.py     -> ./foo.py
+    # e.g. lambda/foo/bar/bar.py -> ./bar/bar.py
+    #
+    # Files and directories in the given prune categories are left out.
+    #
+    def _zipdir(self, zfile, path, categories=()):
+        def pruned(name):
+            return categories and self._prune_category(
+                os.path.join(rel_path, name).lstrip(os.sep),
+                categories
+            )
+
+        with zipfile.ZipFile(zfile, 'w', zipfile.ZIP_DEFLATED) as ziph:
+            for root, dirs, files in os.walk(path):
+                # strip path from beginning of full path
+                rel_path = root
+                if rel_path.startswith(path):
+                    rel_path = rel_path[len(path):]
+
+                    dirs[:] = [d for d in dirs if not pruned(d)]
+                    for file in files:
+                        if pruned(file):
+                            continue
+                        ziph.write(
+                            os.path.join(root, file),
+                            os.path.join(rel_path, file)
+                        )
+
+    def _matches(self, name, patterns):
+        return any(fnmatch.fnmatch(name, p) for p in patterns)
+
+    # The name of the first prune category a path, relative to the
+    # lambda directory, falls in
+    def _prune_category(self, rel_path, categories=None):
+        parts = rel_path.replace(os.sep, '/').split('/')
+        for category, top_level, patterns in self.PRUNE_RULES:
+            if categories is not None and category not in categories:
+                continue
+            checked = parts[:1] if top_level else parts
+            if any(self._matches(part, patterns) for part in checked):
+                return category
+        return None
+
+    def _prune_categories(self, prune):
+        if prune not in self.PRUNE_PROFILES:
+            raise ValueError('unknown prune profile {}, expected one of {}'.format(
+                prune,
+                ', '.join(sorted(self.PRUNE_PROFILES))
+            ))
+        return self.PRUNE_PROFILES[prune]
+
+    # Name patterns of a profile's rules that hold at any depth, for
+    # callers that only look at file and directory names
+    def _prune_patterns(self, prune):
+        categories = self._prune_categories(prune)
+        patterns = []
+        for category, top_level, category_patterns in self.PRUNE_RULES:
+            if category in categories and not top_level:
+                patterns.extend(category_patterns)
+        return patterns
+
+    # The project's directory for a lambda, lambda/<name>
+    def _lambda_dir(self, name):
+        path = os.path.join('lambda', name)
+        if not os.path.isdir(path):
+            raise ValueError('no lambda named {}, {} does not exist'.format(
+                name,
+                path
+            ))
+        return path
+
+    # zip up the project's lambda, returning (zipfile, digest)
+    def _package(self, name, prune=None):
+        path = self._lambda_dir(name)
+        categories = self._prune_categories(prune) if prune else ()
+        # unique per call, concurrent builds must not share a file
+        fd, zfile = tempfile.mkstemp(suffix="_{}_lambda.zip".format(name))
+        os.close(fd)
+        self._zipdir(zfile, path, categories)
+        return zfile, self._file_digest(zfile)
+
+    # sha256 of a file's contents, used to name build artifacts
+    def _file_digest(self, path):
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def _trust_policy(self):
+        return json.dumps(
+            {
+                "Statement": [
+                    {
+                        "Effect": "Allow",
+                        "Principal": {
+                            "Service": ["lambda.amazonaws.com"]
+                        },
+                        "Action": ["sts:AssumeRole"]
+                    }
+                ]
+            }
+        )
+
+    def _long_name(self, name):
+        return 'Lambder-' + name
+
+    # artifacts are keyed by content so old builds stay around
+    # for rollback, e.g. lambder/lambdas/foo_lambda-<sha256>.zip
+    def _s3_prefix(self, name):
+        return "lambder/lambdas/{}_lambda-".format(name)
+
+    def _s3_key(self, name, digest):
+        return "{}{}.zip".format(self._s3_prefix(name), digest)
+
+    # where artifacts went before they were keyed by content
+    def _legacy_s3_key(self, name):
+        return "lambder/lambdas/{}_lambda.zip".format(name)
+
+    def _role_name(self, name):
+        return self._long_name(name) + 'ExecuteRole'
+
+    def _policy_name(self, name):
+        return self._long_name(name) + 'ExecutePolicy'
 
-    def permit_rule_to_invoke_function(self, rule_arn, function_name):
+    # Break down what goes into a function's package: sizes by top level
+    # directory and file type, files a prune profile would drop,
+    # duplicate files, and how long the handler module takes to import.
+    def analyze_package(self, name, prune=None):
+        path = self._lambda_dir(name)
+        zfile, _ = self._package(name)
+        try:
+            with zipfile.ZipFile(zfile) as z:
+                infos = z.infolist()
+            zipped = os.path.getsize(zfile)
+        finally:
+            os.remove(zfile)
+
+        by_dir = collections.defaultdict(lambda: [0, 0])
+        by_type = collections.defaultdict(lambda: [0, 0])
+        flagged = collections.defaultdict(lambda: [0, 0])
+        by_digest = collections.defaultdict(list)
+        for info in infos:
+            rel_path = info.filename.lstrip('/')
+            top = rel_path.split('/')[0] if '/' in rel_path else '.'
+            ext = os.path.splitext(rel_path)[1] or '(none)'
+            category = self._prune_category(rel_path)
+
+            groups = [by_dir[top], by_type[ext]]
+            if category:
+                groups.append(flagged[category])
+            for group in groups:
+                group[0] += 1
+                group[1] += info.file_size
+
+            full = os.path.join(path, rel_path)
+            by_digest[(info.file_size, self._file_digest(full))].append(rel_path)
+
+        report = {
+            'files': len(infos),
+            'size': sum(i.file_size for i in infos),
+            'zipped': zipped,
+            'by_dir': dict(by_dir),
+            'by_type': dict(by_type),
+            'flagged': dict(flagged),
+            'duplicates': sorted(
+                (paths for paths in by_digest.values() if len(paths) > 1),
+                key=len,
+                reverse=True
+            ),
+            'import_time': self._time_import(name),
+        }
+
+        if prune:
+            zfile, _ = self._package(name, prune)
+            report['pruned_zipped'] = os.path.getsize(zfile)
+            os.remove(zfile)
+
+        return report
+
+    # Time importing the handler module from the lambda directory in a
+    # fresh interpreter. The local python stands in for the lambda
+    # runtime, so this is an estimate of cold start import cost. The
+    # timing goes to a file of its own since the module may print.
+    # Returns seconds, or an error message if the import fails or takes
+    # longer than timeout seconds.
+    def _time_import(self, name, timeout=None):
+        timeout = self.IMPORT_TIMEOUT if timeout is None else timeout
+        script = (
+            "import sys, time\n"
+            "sys.path.insert(0, '.')\n"
+            "start = time.time()\n"
+            "__import__({!r})\n"
+            "elapsed = time.time() - start\n"
+            "with open(sys.argv[1], 'w') as f:\n"
+            "    f.write(repr(elapsed))\n"
+        ).format(name)
+
+        fd, timing_file = tempfile.mkstemp(suffix='_import_time')
+        os.close(fd)
+        try:
+            proc = subprocess.Popen(
+                [sys.executable, '-c', script, timing_file],
+                cwd=self._lambda_dir(name),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE
+            )
+            # communicate() has no timeout on python 2
+            timed_out = []
+
+            def kill():
+                timed_out.append(True)
+                proc.kill()
+
+            timer = threading.Timer(timeout, kill)
+            timer.start()
+            try:
+                out, err = proc.communicate()
+            finally:
+                timer.cancel()
+
+            with open(timing_file) as f:
+                elapsed = f.read()
+        finally:
+            os.remove(timing_file)
+
+        if timed_out:
+            return 'import did not finish in {}s'.format(timeout)
+        if not elapsed:
+            lines = err.decode('utf-8', 'replace').strip().splitlines()
+            return lines[-1] if lines else 'import failed'
+        return float(elapsed)
+
+
+class Lambder(LambderBase):
+    # region and profile default to the ones boto3 is configured with
+    def __init__(self, region=None, profile=None):
+        self.session = boto3.session.Session(
+            region_name=region,
+            profile_name=profile
+        )
+        self.awslambda = self.session.client('lambda')
+        self.events = self.session.client('events')
+
+    @property
+    def region(self):
+        return self.session.region_name
+
+    @property
+    def profile(self):
+        return self.session.profile_name
+
+    def permit_rule_to_invoke_function(
+        self,
+        rule_arn,
+        function_name,
+        qualifier=None
+    ):
         statement_id = function_name + "RulePermission"
-        resp = self.awslambda.add_permission(
-            FunctionName=function_name,
-            StatementId=statement_id,
-            Action='lambda:InvokeFunction',
-            Principal='events.amazonaws.com',
-            SourceArn=rule_arn
+        params = {
+            'FunctionName': function_name,
+            'StatementId': statement_id,
+            'Action': 'lambda:InvokeFunction',
+            'Principal': 'events.amazonaws.com',
+            'SourceArn': rule_arn
+        }
+        if qualifier:
+            params['Qualifier'] = qualifier
+        resp = self.awslambda.add_permission(**params)
+
+    # Return the arn schedules should target: the live alias if the
+    # function has one, otherwise the unqualified function arn.
+    def _target_arn(self, function_name):
+        try:
+            resp = self.awslambda.get_alias(
+                FunctionName=function_name,
+                Name=self.ALIAS_NAME
+            )
+            return resp['AliasArn']
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] != 'ResourceNotFoundException':
+                raise
+
+        resp = self.awslambda.get_function(
+            FunctionName=function_name
         )
+        return resp['Configuration']['FunctionArn']
 
     def add_event(
         self,
@@ -62,31 +557,43 @@ class Lambder:
         function_name,
         cron,
         input_event={},
-        enabled=True
+        enabled=True,
+        input_json=None
     ):
         rule_name = self.NAME_PREFIX + name
 
+        # input_json is an already serialized input_event
+        if input_json is None:
+            input_json = self._dump_input(input_event)
+
         # events:put-rule
         resp = self.events.put_rule(
             Name=rule_name,
-            ScheduleExpression=cron
+            ScheduleExpression=cron,
+            State='ENABLED' if enabled else 'DISABLED'
         )
         rule_arn = resp['RuleArn']
 
+        # retrieve the lambda arn, preferring the live alias
+        function_arn = self._target_arn(function_name)
+        _, qualifier = self._parse_function_arn(function_arn)
+
         # try to add the permission, if we fail because it already
         # exists, move on.
         try:
-            self.permit_rule_to_invoke_function(rule_arn, function_name)
+            self.permit_rule_to_invoke_function(
+                rule_arn,
+                function_name,
+                qualifier
+            )
         except botocore.exceptions.ClientError as e:
             if e.response['Error']['Code'] != 'ResourceConflictException':
                 raise
 
-        # retrieve the lambda arn
-        resp = self.awslambda.get_function(
-            FunctionName=function_name
-        )
-
-        function_arn = resp['Configuration']['FunctionArn']
+        # skip put-targets when the rule already sends this input to the
+        # function, so reloading a schedule file only sends what changed
+        if self._target_unchanged(rule_name, name, function_arn, input_json):
+            return
 
         # events:put-targets (needs lambda arn)
         resp = self.events.put_targets(
@@ -95,11 +602,21 @@ class Lambder:
                 {
                     'Id':    name,
                     'Arn':   function_arn,
-                    'Input': json.dumps(input_event)
+                    'Input': input_json
                 }
             ]
         )
 
+    def _target_unchanged(self, rule_name, name, function_arn, input_json):
+        resp = self.events.list_targets_by_rule(
+            Rule=rule_name
+        )
+        return any(
+            t['Id'] == name and t['Arn'] == function_arn and
+            t.get('Input') == input_json
+            for t in resp['Targets']
+        )
+
     def list_events(self):
         # List all rules by prefix 'Lambder'
         resp = self.events.list_rules(
@@ -119,7 +636,7 @@ class Lambder:
             # assume only one target for now
             name = targets[0]['Id']
             arn = targets[0]['Arn']
-            function_name = arn.split(':')[-1]
+            function_name, _ = self._parse_function_arn(arn)
             cron = rule['ScheduleExpression']
             enabled = rule['State'] == 'ENABLED'
 
@@ -131,7 +648,7 @@ class Lambder:
             )
             entries.append(entry)
 
-            return entries
+        return entries
 
     def delete_event(self, name):
         rule_name = self.NAME_PREFIX + name
@@ -143,7 +660,7 @@ class Lambder:
         targets = resp['Targets']
         # assume only one target for now
         arn = targets[0]['Arn']
-        function_name = arn.split(':')[-1]
+        function_name, qualifier = self._parse_function_arn(arn)
         statement_id = function_name + "RulePermission"
 
         # delete the target
@@ -153,10 +670,13 @@ class Lambder:
         )
 
         # delete the permission
-        resp = self.awslambda.remove_permission(
-            FunctionName=function_name,
-            StatementId=statement_id
-        )
+        params = {
+            'FunctionName': function_name,
+            'StatementId': statement_id
+        }
+        if qualifier:
+            params['Qualifier'] = qualifier
+        resp = self.awslambda.remove_permission(**params)
 
         # delete the rule
         resp = self.events.delete_rule(
@@ -175,15 +695,39 @@ class Lambder:
             Name=rule_name
         )
 
+    # Load events from a json document. It is either a list of entries
+    # or an object with 'events' (that list) and 'templates' (inputs
+    # shared between entries). Every entry is validated before any
+    # call is made, so a bad file fails up front rather than halfway.
     def load_events(self, data):
-        entries = json.loads(data)
+        entries = self._prepare_events(data)
+        self._check_s3_inputs(entries)
         for entry in entries:
-            self.add(
+            self.add_event(
                 name=entry['name'],
                 cron=entry['cron'],
                 function_name=entry['function_name'],
-                input_event=entry['input_event'],
-                enabled=entry['enabled']
+                enabled=entry['enabled'],
+                input_json=entry['input_json']
+            )
+
+    # make sure every referenced S3 input exists, checking each once
+    def _check_s3_inputs(self, entries):
+        s3 = self.session.client('s3')
+        urls = set(e['input_s3'] for e in entries if e['input_s3'])
+        missing = []
+        for url in sorted(urls):
+            bucket, key = self._parse_s3_url(url)
+            try:
+                s3.head_object(Bucket=bucket, Key=key)
+            except botocore.exceptions.ClientError as e:
+                if not self._object_missing(e):
+                    raise
+                missing.append(url)
+
+        if missing:
+            raise ValueError(
+                'input_s3 objects not found:\n  ' + '\n  '.join(missing)
             )
 
     def create_project(self, name, bucket, config):
@@ -200,65 +744,45 @@ class Lambder:
             extra_context=context
         )
 
-    # Recursively zip path, creating a zipfile with contents
-    # relative to path.
-    # e.g. lambda/foo/foo.py     -> ./foo.py
-    # e.g. lambda/foo/bar/bar.py -> ./bar/bar.py
-    #
-    def _zipdir(self, zfile, path):
-        with zipfile.ZipFile(zfile, 'w') as ziph:
-            for root, dirs, files in os.walk(path):
-
-                # strip path from beginning of full path
-                rel_path = root
-                if rel_path.startswith(path):
-                    rel_path = rel_path[len(path):]
-
-                    for file in files:
-                        ziph.write(
-                            os.path.join(root, file),
-                            os.path.join(rel_path, file)
-                        )
-
     def _s3_cp(self, src, dest_bucket, dest_key):
-        s3 = boto3.client('s3')
+        s3 = self.session.client('s3')
         s3.upload_file(src, dest_bucket, dest_key)
 
+    # server-side copy, e.g. to seed a bucket in another region
+    def _s3_copy(self, src_bucket, key, dest_bucket):
+        s3 = self.session.client('s3')
+        s3.copy_object(
+            CopySource={'Bucket': src_bucket, 'Key': key},
+            Bucket=dest_bucket,
+            Key=key
+        )
+
     def _s3_rm(self, bucket, key):
-        s3 = boto3.resource('s3')
+        s3 = self.session.resource('s3')
         the_bucket = s3.Bucket(bucket)
         the_object = the_bucket.Object(key)
         the_object.delete()
 
+    def _s3_rm_prefix(self, bucket, prefix):
+        s3 = self.session.resource('s3')
+        the_bucket = s3.Bucket(bucket)
+        the_bucket.objects.filter(Prefix=prefix).delete()
+
     def _create_lambda_role(self, role_name):
-        iam = boto3.resource('iam')
+        iam = self.session.resource('iam')
         role = iam.Role(role_name)
         # return the role if it already exists
         if role in iam.roles.all():
             return role
 
-        trust_policy = json.dumps(
-            {
-                "Statement": [
-                    {
-                        "Effect": "Allow",
-                        "Principal": {
-                            "Service": ["lambda.amazonaws.com"]
-                        },
-                        "Action": ["sts:AssumeRole"]
-                    }
-                ]
-            }
-        )
-
         role = iam.create_role(
             RoleName=role_name,
-            AssumeRolePolicyDocument=trust_policy
+            AssumeRolePolicyDocument=self._trust_policy()
         )
         return role
 
     def _delete_lambda_role(self, name):
-        iam = boto3.resource('iam')
+        iam = self.session.resource('iam')
 
         role_name = self._role_name(name)
         policy_name = self._policy_name(name)
@@ -276,7 +800,7 @@ class Lambder:
             role.delete()
 
     def _put_role_policy(self, role, policy_name, policy_doc):
-        iam = boto3.client('iam')
+        iam = self.session.client('iam')
         policy = iam.put_role_policy(
             RoleName=role.name,
             PolicyName=policy_name,
@@ -284,15 +808,14 @@ class Lambder:
         )
 
     def _attach_vpc_policy(self, role):
-        iam = boto3.client('iam')
+        iam = self.session.client('iam')
         iam.attach_role_policy(
             RoleName=role,
-            PolicyArn='arn:aws:iam::aws:policy/service-role/\
-                AWSLambdaVPCAccessExecutionRole'
+            PolicyArn=self.VPC_POLICY_ARN
         )
 
     def _lambda_exists(self, name):
-        awslambda = boto3.client('lambda')
+        awslambda = self.awslambda
         try:
             resp = awslambda.get_function(
                 FunctionName=self._long_name(name)
@@ -315,12 +838,8 @@ class Lambder:
         description,
         vpc_config
     ):
-        awslambda = boto3.client('lambda')
-        resp = awslambda.update_function_code(
-            FunctionName=self._long_name(name),
-            S3Bucket=bucket,
-            S3Key=key
-        )
+        awslambda = self.awslambda
+        self.update_code(name, bucket, key)
 
         resp = awslambda.update_function_configuration(
             FunctionName=self._long_name(name),
@@ -329,6 +848,14 @@ class Lambder:
             Description=description,
             VpcConfig=vpc_config
         )
+        self._wait_for_update(name)
+
+        # snapshot the new code and configuration as a version
+        resp = awslambda.publish_version(
+            FunctionName=self._long_name(name),
+            CodeSha256=resp['CodeSha256']
+        )
+        return resp['Version']
 
     def _create_lambda(
         self,
@@ -341,7 +868,7 @@ class Lambder:
         description,
         vpc_config
     ):
-        awslambda = boto3.client('lambda')
+        awslambda = self.awslambda
         resp = awslambda.create_function(
             FunctionName=self._long_name(name),
             Runtime='python2.7',
@@ -354,28 +881,100 @@ class Lambder:
             Timeout=timeout,
             MemorySize=memory,
             Description=description,
-            VpcConfig=vpc_config
+            VpcConfig=vpc_config,
+            Publish=True
+        )
+        return resp['Version']
+
+    # Point the live alias at version, creating the alias if needed.
+    # Returns the alias arn.
+    def _set_alias(self, name, version):
+        awslambda = self.awslambda
+        try:
+            resp = awslambda.update_alias(
+                FunctionName=self._long_name(name),
+                Name=self.ALIAS_NAME,
+                FunctionVersion=version
+            )
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] != 'ResourceNotFoundException':
+                raise
+            resp = awslambda.create_alias(
+                FunctionName=self._long_name(name),
+                Name=self.ALIAS_NAME,
+                FunctionVersion=version
+            )
+        return resp['AliasArn']
+
+    # Point this function's lambder rules that still target the
+    # unqualified function (added before its first aliased deploy) at
+    # the live alias, so moving the alias moves what schedules run.
+    # Returns the names of the rules that were moved.
+    def _retarget_events(self, alias_arn):
+        function_name, _ = self._parse_function_arn(alias_arn)
+        function_arn = alias_arn.rsplit(':', 1)[0]
+
+        rule_names = []
+        params = {'TargetArn': function_arn}
+        while True:
+            resp = self.events.list_rule_names_by_target(**params)
+            rule_names.extend(
+                r for r in resp['RuleNames']
+                if r.startswith(self.NAME_PREFIX)
+            )
+            if not resp.get('NextToken'):
+                break
+            params['NextToken'] = resp['NextToken']
+
+        for rule_name in rule_names:
+            rule_arn = self.events.describe_rule(Name=rule_name)['Arn']
+            try:
+                self.permit_rule_to_invoke_function(
+                    rule_arn,
+                    function_name,
+                    self.ALIAS_NAME
+                )
+            except botocore.exceptions.ClientError as e:
+                if e.response['Error']['Code'] != 'ResourceConflictException':
+                    raise
+
+            resp = self.events.list_targets_by_rule(Rule=rule_name)
+            targets = [
+                dict(t, Arn=alias_arn) for t in resp['Targets']
+                if t['Arn'] == function_arn
+            ]
+            if targets:
+                self.events.put_targets(Rule=rule_name, Targets=targets)
+
+        return rule_names
+
+    def _get_alias_version(self, name):
+        awslambda = self.awslambda
+        resp = awslambda.get_alias(
+            FunctionName=self._long_name(name),
+            Name=self.ALIAS_NAME
         )
+        return resp['FunctionVersion']
+
+    # All published version numbers of a function, oldest first
+    def _list_versions(self, name):
+        awslambda = self.awslambda
+        paginator = awslambda.get_paginator('list_versions_by_function')
+        versions = []
+        pages = paginator.paginate(FunctionName=self._long_name(name))
+        for page in pages:
+            for v in page['Versions']:
+                if v['Version'] != '$LATEST':
+                    versions.append(int(v['Version']))
+        return sorted(versions)
 
     def _delete_lambda(self, name):
-        awslambda = boto3.client('lambda')
+        awslambda = self.awslambda
         if self._lambda_exists(name):
             resp = awslambda.delete_function(
                 FunctionName=self._long_name(name)
             )
 
-    def _long_name(self, name):
-        return 'Lambder-' + name
-
-    def _s3_key(self, name):
-        return "lambder/lambdas/{}_lambda.zip".format(name)
-
-    def _role_name(self, name):
-        return self._long_name(name) + 'ExecuteRole'
-
-    def _policy_name(self, name):
-        return self._long_name(name) + 'ExecutePolicy'
-
     def deploy_function(
         self,
         name,
@@ -383,45 +982,24 @@ class Lambder:
         timeout,
         memory,
         description,
-        vpc_config
+        vpc_config,
+        s3_key=None,
+        prune=None,
+        role=None
     ):
-        long_name = self._long_name(name)
-        s3_key = self._s3_key(name)
-        role_name = self._role_name(name)
-        policy_name = self._policy_name(name)
-        policy_file = os.path.join('iam', 'policy.json')
-
-        # zip up the lambda
-        zfile = os.path.join(
-            tempfile.gettempdir(),
-            "{}_lambda.zip".format(name)
-        )
-        self._zipdir(zfile, os.path.join('lambda', name))
-
-        # upload it to s3
-        self._s3_cp(zfile, bucket, s3_key)
+        # package and upload unless the caller already put the
+        # artifact in the bucket
+        if s3_key is None:
+            s3_key = self._upload_package(name, bucket, prune)
 
-        # remove tempfile
-        os.remove(zfile)
-
-        # create the lambda execute role if it does not already exist
-        role = self._create_lambda_role(role_name)
-
-        # update the role's policy from the document in the project
-        policy_doc = None
-        with open(policy_file, 'r') as f:
-            policy_doc = f.read()
-
-        self._put_role_policy(role, policy_name, policy_doc)
-
-        # add the vpc policy to the role if vpc_config is set
-        if vpc_config:
-            self._attach_vpc_policy(role_name)
+        # set up the role unless the caller already did
+        if role is None:
+            role = self.deploy_role(name, vpc_config)
 
         # create or update the lambda function
         timeout_i = int(timeout)
         if self._lambda_exists(name):
-            self._update_lambda(
+            version = self._update_lambda(
                 name,
                 bucket,
                 s3_key,
@@ -432,7 +1010,7 @@ class Lambder:
             )
         else:
             time.sleep(5)  # wait for role to be created
-            self._create_lambda(
+            version = self._create_lambda(
                 name,
                 bucket,
                 s3_key,
@@ -443,28 +1021,106 @@ class Lambder:
                 vpc_config
             )
 
+        # move the live alias to the version we just published
+        alias_arn = self._set_alias(name, version)
+        self._retarget_events(alias_arn)
+        return version
+
+    # zip up the lambda, upload it to s3 and return its key
+    def _upload_package(self, name, bucket, prune=None):
+        zfile, digest = self._package(name, prune)
+        s3_key = self._s3_key(name, digest)
+
+        try:
+            self._s3_cp(zfile, bucket, s3_key)
+        finally:
+            os.remove(zfile)
+
+        return s3_key
+
+    # Create or update the role and add the vpc policy to it if
+    # vpc_config is set
+    def deploy_role(self, name, vpc_config):
+        role = self.deploy_policy(name)
+        if vpc_config:
+            self._attach_vpc_policy(self._role_name(name))
+        return role
+
+    # Create the lambda execute role if it does not already exist and
+    # update its policy from the document in the project.
+    def deploy_policy(self, name):
+        role = self._create_lambda_role(self._role_name(name))
+
+        policy_doc = None
+        with open(os.path.join('iam', 'policy.json'), 'r') as f:
+            policy_doc = f.read()
+
+        self._put_role_policy(role, self._policy_name(name), policy_doc)
+        return role
+
+    # Replace the code of an existing function without publishing a
+    # version or touching its configuration. The live alias stays put,
+    # so only unqualified invocations see the new code.
+    def update_code(self, name, bucket, s3_key=None, prune=None):
+        if s3_key is None:
+            s3_key = self._upload_package(name, bucket, prune)
+
+        resp = self.awslambda.update_function_code(
+            FunctionName=self._long_name(name),
+            S3Bucket=bucket,
+            S3Key=s3_key
+        )
+        self._wait_for_update(name)
+        return resp['CodeSha256']
+
+    # lambda rejects further changes to a function while an update is
+    # still in progress
+    def _wait_for_update(self, name):
+        waiter = self.awslambda.get_waiter('function_updated')
+        waiter.wait(FunctionName=self._long_name(name))
+
+    # Point the live alias at a previously published version. Defaults
+    # to the version just before the one currently live.
+    def rollback_function(self, name, version=None):
+        if version is None:
+            current = int(self._get_alias_version(name))
+            older = [v for v in self._list_versions(name) if v < current]
+            if not older:
+                raise ValueError(
+                    'no version older than {} to roll back to'.format(current)
+                )
+            version = older[-1]
+
+        # schedules still on the unqualified function would keep
+        # running $LATEST, move them onto the alias too
+        alias_arn = self._set_alias(name, str(version))
+        self._retarget_events(alias_arn)
+        return str(version)
+
     # List only the lambder functions, i.e. ones starting with 'Lambder-'
     def list_functions(self):
-        awslambda = boto3.client('lambda')
+        awslambda = self.awslambda
         resp = awslambda.list_functions()
         functions = resp['Functions']
-        return filter(
-            lambda x: x['FunctionName'].startswith(self.NAME_PREFIX),
-            functions
-        )
+        return [
+            f for f in functions
+            if f['FunctionName'].startswith(self.NAME_PREFIX)
+        ]
 
     def _delete_lambda_zip(self, name, bucket):
-        key = self._s3_key(name)
-        self._s3_rm(bucket, key)
+        prefix = self._s3_prefix(name)
+        self._s3_rm_prefix(bucket, prefix)
+        self._s3_rm(bucket, self._legacy_s3_key(name))
 
     # delete all the things associated with this function
-    def delete_function(self, name, bucket):
+    def delete_function(self, name, bucket, delete_role=True):
         self._delete_lambda(name)
-        self._delete_lambda_role(name)
+        if delete_role:
+            self._delete_lambda_role(name)
         self._delete_lambda_zip(name, bucket)
 
     def invoke_function(self, name, input_event):
-        awslambda = boto3.client('lambda')
+        awslambda = self.awslambda
         payload = '{}'  # default to empty event
 
         if input_event:
@@ -478,3 +1134,284 @@ class Lambder:
         )
         results = resp['Payload'].read()  # payload is a 'StreamingBody'
         return results
+
+
+class Result:
+    # Outcome of running one operation against one Lambder target
+    def __init__(self, lambder, value=None, error=None):
+        self.lambder = lambder
+        self.value = value
+        self.error = error
+
+    @property
+    def label(self):
+        return "{}/{}".format(
+            self.lambder.profile or 'default',
+            self.lambder.region
+        )
+
+
+class LambderGroup:
+    # Runs Lambder operations against every profile x region target in
+    # parallel. With no regions or profiles it has a single target using
+    # boto3's defaults, so it can stand in for a plain Lambder.
+
+    def __init__(self, regions=None, profiles=None, max_workers=10):
+        self.max_workers = max_workers
+        self.configure(regions, profiles)
+
+    def configure(self, regions=None, profiles=None):
+        self.regions = regions or [None]
+        self.profiles = profiles or [None]
+        self._members = None
+
+    # clients are created on first use, not at import time
+    @property
+    def members(self):
+        if self._members is None:
+            self._members = [
+                Lambder(region=region, profile=profile)
+                for profile in self.profiles
+                for region in self.regions
+            ]
+        return self._members
+
+    @property
+    def is_fanned_out(self):
+        return len(self.regions) * len(self.profiles) > 1
+
+    # Call func(lambder) for each member in parallel, returning a Result
+    # per member in target order. Errors are captured, not raised.
+    def map(self, func, members=None):
+        members = self.members if members is None else list(members)
+
+        def run(member):
+            try:
+                return Result(member, value=func(member))
+            except Exception as e:
+                return Result(member, error=e)
+
+        if len(members) <= 1:
+            return [run(m) for m in members]
+
+        workers = min(self.max_workers, len(members))
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            return list(pool.map(run, members))
+
+    # Call a Lambder method by name on every member
+    def run(self, method, *args, **kwargs):
+        return self.map(lambda m: getattr(m, method)(*args, **kwargs))
+
+    # Bucket names may contain '{region}' to use one bucket per region
+    def bucket_for(self, member, bucket):
+        return bucket.replace('{region}', member.region or '')
+
+    # Lambda only takes code from a bucket in the function's region
+    def check_bucket(self, bucket):
+        regions = set(m.region for m in self.members)
+        if len(regions) > 1 and '{region}' not in bucket:
+            raise ValueError(
+                'deploying to several regions needs a bucket per region, '
+                'put {region} in the bucket name, e.g. mybucket-{region}'
+            )
+
+    # IAM is global to an account, so role work runs once per profile
+    # and one at a time, using the first member of each profile.
+    def _first_per_profile(self):
+        firsts = []
+        seen = set()
+        for member in self.members:
+            if member.profile not in seen:
+                seen.add(member.profile)
+                firsts.append(member)
+        return firsts
+
+    # Run func once per profile, serially. Returns the Results, keyed
+    # by profile.
+    def _per_profile(self, func):
+        results = {}
+        for member in self._first_per_profile():
+            results[member.profile] = self.map(func, [member])[0]
+        return results
+
+    # Build the artifact once, upload it to one bucket per profile and
+    # copy it server-side to the remaining buckets. Returns the artifact
+    # key and a function that raises for members whose bucket never got
+    # the artifact and otherwise returns their bucket.
+    def _distribute_package(self, name, bucket, prune=None):
+        self.check_bucket(bucket)
+
+        def target(member):
+            return (member.profile, self.bucket_for(member, bucket))
+
+        # one member per distinct (profile, bucket), and the first
+        # bucket of each profile is seeded from the local zipfile
+        buckets = []
+        owners = {}
+        seeds = {}
+        for member in self.members:
+            t = target(member)
+            if t not in owners:
+                buckets.append(t)
+                owners[t] = member
+                seeds.setdefault(member.profile, t)
+
+        first = self.members[0]
+        zfile, digest = first._package(name, prune)
+        s3_key = first._s3_key(name, digest)
+
+        errors = {}
+        seeded = [t for t in buckets if seeds[t[0]] == t]
+        try:
+            results = self.map(
+                lambda m: m._s3_cp(zfile, target(m)[1], s3_key),
+                [owners[t] for t in seeded]
+            )
+        finally:
+            os.remove(zfile)
+        for t, result in zip(seeded, results):
+            if result.error:
+                errors[t] = result.error
+
+        copied = [
+            t for t in buckets
+            if t not in seeded and seeds[t[0]] not in errors
+        ]
+        results = self.map(
+            lambda m: m._s3_copy(seeds[m.profile][1], s3_key, target(m)[1]),
+            [owners[t] for t in copied]
+        )
+        for t, result in zip(copied, results):
+            if result.error:
+                errors[t] = result.error
+
+        def bucket_of(member):
+            t = target(member)
+            error = errors.get(t) or errors.get(seeds[member.profile])
+            if error:
+                raise error
+            return t[1]
+
+        return s3_key, bucket_of
+
+    def deploy_function(
+        self,
+        name,
+        bucket,
+        timeout,
+        memory,
+        description,
+        vpc_config,
+        prune=None
+    ):
+        s3_key, bucket_of = self._distribute_package(name, bucket, prune)
+        roles = self._per_profile(lambda m: m.deploy_role(name, vpc_config))
+
+        def deploy(member):
+            role = roles[member.profile]
+            if role.error:
+                raise role.error
+            return member.deploy_function(
+                name,
+                bucket_of(member),
+                timeout,
+                memory,
+                description,
+                vpc_config,
+                s3_key=s3_key,
+                role=role.value
+            )
+
+        return self.map(deploy)
+
+    def deploy_policy(self, name):
+        results = self._per_profile(lambda m: m.deploy_policy(name))
+        return [results[m.profile] for m in self._first_per_profile()]
+
+    # Delete the function in every region, then its role once per
+    # profile whose deletes all succeeded.
+    def delete_function(self, name, bucket):
+        results = self.map(
+            lambda m: m.delete_function(
+                name,
+                self.bucket_for(m, bucket),
+                delete_role=False
+            )
+        )
+        failed = set(r.lambder.profile for r in results if r.error)
+
+        for member in self._first_per_profile():
+            if member.profile in failed:
+                continue
+            role = self.map(lambda m: m._delete_lambda_role(name), [member])[0]
+            if role.error:
+                results[self.members.index(member)] = role
+
+        return results
+
+    def update_code(self, name, bucket, prune=None):
+        s3_key, bucket_of = self._distribute_package(name, bucket, prune)
+        return self.map(
+            lambda m: m.update_code(name, bucket_of(m), s3_key=s3_key)
+        )
+
+
+class Watcher:
+    # Polls a set of files and directories for changes. A batch of
+    # changes is reported once nothing has changed for `debounce`
+    # seconds, so an editor saving several files causes one rebuild.
+    # Files and directories matching exclude patterns, and editor swap
+    # and backup files, are ignored.
+
+    EDITOR_PATTERNS = ['*.swp', '*.swx', '*~', '.#*', '#*#', '4913']
+
+    def __init__(self, paths, exclude=(), interval=0.5, debounce=1.0):
+        self.paths = paths
+        self.exclude = list(exclude) + self.EDITOR_PATTERNS
+        self.interval = interval
+        self.debounce = debounce
+
+    def _excluded(self, name):
+        return any(fnmatch.fnmatch(name, p) for p in self.exclude)
+
+    # Map each watched path to the (mtime, size) of every file under it
+    def _snapshot(self):
+        snapshot = {}
+        for path in self.paths:
+            files = {}
+            if os.path.isdir(path):
+                for root, dirs, names in os.walk(path):
+                    dirs[:] = [d for d in dirs if not self._excluded(d)]
+                    for name in names:
+                        if self._excluded(name):
+                            continue
+                        full = os.path.join(root, name)
+                        try:
+                            st = os.stat(full)
+                        except OSError:
+                            continue  # removed while walking
+                        files[full] = (st.st_mtime, st.st_size)
+            elif os.path.exists(path):
+                st = os.stat(path)
+                files[path] = (st.st_mtime, st.st_size)
+            snapshot[path] = files
+        return snapshot
+
+    # Yield the set of watched paths that changed, forever
+    def changes(self):
+        last = self._snapshot()
+        pending = set()
+        settled_at = None
+
+        while True:
+            time.sleep(self.interval)
+            current = self._snapshot()
+            changed = set(p for p in self.paths if current[p] != last[p])
+            last = current
+
+            if changed:
+                pending |= changed
+                settled_at = time.time() + self.debounce
+            elif pending and time.time() >= settled_at:
+                yield pending
+                pending = set()
@@ -7,7 +7,8 @@ dependencies = [
   'click>=6.2',
   'boto3>=1.2.6',
   'botocore>=1.4.0',
-  'cookiecutter>=1.3.0'
+  'cookiecutter>=1.3.0',
+  'futures>=3.0.5; python_version < "3"'
 ]
 
 setup(
@@ -24,6 +25,10 @@ setup(
     zip_safe=False,
     platforms='any',
     install_requires=dependencies,
+    extras_require={
+        # AsyncLambder, python 3.7+ only
+        'async': ['aiobotocore>=2.0.0'],
+    },
     entry_points={
         'console_scripts': [
             'lambder = lambder.cli:cli',
@@ -0,0 +1,6 @@
+import sys
+
+# AsyncLambder is python 3.7+ only
+collect_ignore = []
+if sys.version_info < (3, 7):
+    collect_ignore.append('test_async_lambder.py')
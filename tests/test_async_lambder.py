@@ -0,0 +1,366 @@
+import asyncio
+import os
+import pytest
+
+pytest.importorskip('aiobotocore')
+
+from aiobotocore.stub import AioStubber  # noqa: E402
+from botocore.stub import ANY  # noqa: E402
+from lambder import async_lambder  # noqa: E402
+from lambder.async_lambder import AsyncLambder  # noqa: E402
+
+FUNCTION_ARN = 'arn:aws:lambda:us-east-1:123456789012:function:Lambder-foo'
+ALIAS_ARN = FUNCTION_ARN + ':live'
+RULE_ARN = 'arn:aws:events:us-east-1:123456789012:rule/Lambder-nightly'
+ROLE_ARN = 'arn:aws:iam::123456789012:role/Lambder-fooExecuteRole'
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def lambder(monkeypatch, loop):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    lambder = AsyncLambder(region='us-east-1')
+    loop.run_until_complete(lambder.__aenter__())
+    yield lambder
+    loop.run_until_complete(lambder.__aexit__(None, None, None))
+
+
+@pytest.fixture
+def stubs(lambder):
+    stubbers = dict(
+        (service, AioStubber(getattr(lambder, service)))
+        for service in ['awslambda', 'events', 's3', 'iam']
+    )
+    for stubber in stubbers.values():
+        stubber.activate()
+    yield stubbers
+    for stubber in stubbers.values():
+        stubber.deactivate()
+        stubber.assert_no_pending_responses()
+
+
+@pytest.fixture
+def project(tmpdir, monkeypatch):
+    tmpdir.join('lambda', 'foo', 'foo.py').write('x = 1\n', ensure=True)
+    tmpdir.join('iam', 'policy.json').write('{}', ensure=True)
+    monkeypatch.chdir(tmpdir)
+    return tmpdir
+
+
+class FakeSession:
+    # Hands out clients that record being closed; 'fail' can't be opened
+    def __init__(self, fail):
+        self.fail = fail
+        self.closed = []
+
+    def set_config_variable(self, name, value):
+        pass
+
+    def create_client(self, service, **kwargs):
+        return FakeClient(self, service)
+
+
+class FakeClient:
+    def __init__(self, session, service):
+        self.session = session
+        self.service = service
+
+    async def __aenter__(self):
+        if self.service == self.session.fail:
+            raise RuntimeError('cannot create ' + self.service)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.session.closed.append(self.service)
+
+
+def test_region_before_enter():
+    assert AsyncLambder(region='eu-west-1').region == 'eu-west-1'
+
+
+def test_enter_closes_opened_clients_on_failure(monkeypatch, loop):
+    session = FakeSession(fail='s3')
+    monkeypatch.setattr(async_lambder, 'get_session', lambda: session)
+    lambder = AsyncLambder(region='us-east-1')
+
+    with pytest.raises(RuntimeError):
+        loop.run_until_complete(lambder.__aenter__())
+
+    assert session.closed == ['events', 'lambda']
+    assert lambder.region == 'us-east-1'
+
+
+def test_gather_keeps_order(lambder, loop):
+    async def value(v, delay):
+        await asyncio.sleep(delay)
+        return v
+
+    coros = [value(1, 0.02), value(2, 0), value(3, 0.01)]
+    assert loop.run_until_complete(lambder._gather(coros)) == [1, 2, 3]
+
+
+def test_gather_cancels_the_rest_on_failure(lambder, loop):
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def fail():
+        raise RuntimeError('boom')
+
+    with pytest.raises(RuntimeError):
+        loop.run_until_complete(lambder._gather([slow(), fail(), slow()]))
+    assert cancelled == [True, True]
+
+
+def stub_add_event(stubs, targets):
+    stubs['events'].add_response(
+        'put_rule',
+        {'RuleArn': RULE_ARN},
+        {
+            'Name': 'Lambder-nightly',
+            'ScheduleExpression': 'rate(1 day)',
+            'State': 'ENABLED'
+        }
+    )
+    stubs['awslambda'].add_response(
+        'get_alias',
+        {'AliasArn': ALIAS_ARN},
+        {'FunctionName': 'foo', 'Name': 'live'}
+    )
+    stubs['awslambda'].add_client_error(
+        'add_permission',
+        'ResourceConflictException'
+    )
+    stubs['events'].add_response(
+        'list_targets_by_rule',
+        {'Targets': targets},
+        {'Rule': 'Lambder-nightly'}
+    )
+
+
+def test_add_event_skips_unchanged_target(lambder, stubs, loop):
+    stub_add_event(
+        stubs,
+        [{'Id': 'nightly', 'Arn': ALIAS_ARN, 'Input': '{"a":1}'}]
+    )
+
+    loop.run_until_complete(
+        lambder.add_event('nightly', 'foo', 'rate(1 day)', {'a': 1})
+    )
+
+
+def test_add_event_puts_changed_target(lambder, stubs, loop):
+    stub_add_event(
+        stubs,
+        [{'Id': 'nightly', 'Arn': ALIAS_ARN, 'Input': '{"a":0}'}]
+    )
+    stubs['events'].add_response(
+        'put_targets',
+        {'FailedEntryCount': 0},
+        {
+            'Rule': 'Lambder-nightly',
+            'Targets': [{'Id': 'nightly', 'Arn': ALIAS_ARN, 'Input': '{"a":1}'}]
+        }
+    )
+
+    loop.run_until_complete(
+        lambder.add_event('nightly', 'foo', 'rate(1 day)', {'a': 1})
+    )
+
+
+def stub_set_alias(stubs, version):
+    stubs['awslambda'].add_response(
+        'update_alias',
+        {'AliasArn': ALIAS_ARN, 'FunctionVersion': version},
+        {'FunctionName': 'Lambder-foo', 'Name': 'live', 'FunctionVersion': version}
+    )
+    stubs['events'].add_response(
+        'list_rule_names_by_target',
+        {'RuleNames': []},
+        {'TargetArn': FUNCTION_ARN}
+    )
+
+
+def test_rollback_defaults_to_previous_version(lambder, stubs, loop):
+    stubs['awslambda'].add_response(
+        'get_alias',
+        {'FunctionVersion': '5'},
+        {'FunctionName': 'Lambder-foo', 'Name': 'live'}
+    )
+    stubs['awslambda'].add_response(
+        'list_versions_by_function',
+        {'Versions': [{'Version': v} for v in ['$LATEST', '6', '3', '5', '4']]},
+        {'FunctionName': 'Lambder-foo'}
+    )
+    stub_set_alias(stubs, '4')
+
+    assert loop.run_until_complete(lambder.rollback_function('foo')) == '4'
+
+
+def stub_deploy_lookups(stubs, exists):
+    stubs['iam'].add_response(
+        'get_role',
+        {
+            'Role': {
+                'Path': '/',
+                'RoleName': 'Lambder-fooExecuteRole',
+                'RoleId': 'AROAEXAMPLEEXAMPLE1',
+                'Arn': ROLE_ARN,
+                'CreateDate': '2020-01-01T00:00:00Z'
+            }
+        },
+        {'RoleName': 'Lambder-fooExecuteRole'}
+    )
+    if exists:
+        stubs['awslambda'].add_response(
+            'get_function',
+            {'Configuration': {'FunctionArn': FUNCTION_ARN}},
+            {'FunctionName': 'Lambder-foo'}
+        )
+    else:
+        stubs['awslambda'].add_client_error(
+            'get_function',
+            'ResourceNotFoundException'
+        )
+    stubs['s3'].add_response(
+        'put_object',
+        {},
+        {'Bucket': 'bucket', 'Key': ANY, 'Body': ANY}
+    )
+    stubs['iam'].add_response(
+        'put_role_policy',
+        {},
+        {
+            'RoleName': 'Lambder-fooExecuteRole',
+            'PolicyName': 'Lambder-fooExecutePolicy',
+            'PolicyDocument': '{}'
+        }
+    )
+
+
+def test_deploy_creates_new_function(lambder, stubs, loop, project, monkeypatch):
+    async def no_sleep(seconds):
+        pass
+
+    monkeypatch.setattr(async_lambder.asyncio, 'sleep', no_sleep)
+    stub_deploy_lookups(stubs, exists=False)
+    stubs['awslambda'].add_response(
+        'create_function',
+        {'Version': '1'},
+        {
+            'FunctionName': 'Lambder-foo',
+            'Runtime': 'python2.7',
+            'Role': ROLE_ARN,
+            'Handler': 'foo.handler',
+            'Code': {'S3Bucket': 'bucket', 'S3Key': ANY},
+            'Timeout': 30,
+            'MemorySize': 128,
+            'Description': 'd',
+            'VpcConfig': {},
+            'Publish': True
+        }
+    )
+    stubs['awslambda'].add_client_error('update_alias', 'ResourceNotFoundException')
+    stubs['awslambda'].add_response(
+        'create_alias',
+        {'AliasArn': ALIAS_ARN},
+        {'FunctionName': 'Lambder-foo', 'Name': 'live', 'FunctionVersion': '1'}
+    )
+    stubs['events'].add_response(
+        'list_rule_names_by_target',
+        {'RuleNames': []},
+        {'TargetArn': FUNCTION_ARN}
+    )
+
+    version = loop.run_until_complete(
+        lambder.deploy_function('foo', 'bucket', '30', 128, 'd', {})
+    )
+
+    assert version == '1'
+
+
+def test_deploy_updates_existing_function(lambder, stubs, loop, project):
+    stub_deploy_lookups(stubs, exists=True)
+    waited = {'FunctionName': 'Lambder-foo'}
+    stubs['awslambda'].add_response(
+        'update_function_code',
+        {'CodeSha256': 'abc'},
+        {'FunctionName': 'Lambder-foo', 'S3Bucket': 'bucket', 'S3Key': ANY}
+    )
+    stubs['awslambda'].add_response(
+        'get_function_configuration',
+        {'LastUpdateStatus': 'Successful'},
+        waited
+    )
+    stubs['awslambda'].add_response(
+        'update_function_configuration',
+        {'CodeSha256': 'abc'},
+        {
+            'FunctionName': 'Lambder-foo',
+            'Timeout': 30,
+            'MemorySize': 128,
+            'Description': 'd',
+            'VpcConfig': {}
+        }
+    )
+    stubs['awslambda'].add_response(
+        'get_function_configuration',
+        {'LastUpdateStatus': 'Successful'},
+        waited
+    )
+    stubs['awslambda'].add_response(
+        'publish_version',
+        {'Version': '7'},
+        {'FunctionName': 'Lambder-foo', 'CodeSha256': 'abc'}
+    )
+    stub_set_alias(stubs, '7')
+
+    version = loop.run_until_complete(
+        lambder.deploy_function('foo', 'bucket', '30', 128, 'd', {})
+    )
+
+    assert version == '7'
+
+
+def test_deploy_removes_zipfile_when_a_lookup_fails(
+    lambder,
+    stubs,
+    loop,
+    project,
+    monkeypatch
+):
+    zfiles = []
+    package = lambder._package
+
+    def recording_package(name, prune=None):
+        zfile, digest = package(name, prune)
+        zfiles.append(zfile)
+        return zfile, digest
+
+    monkeypatch.setattr(lambder, '_package', recording_package)
+    stubs['iam'].add_client_error('get_role', 'AccessDenied', http_status_code=403)
+    stubs['awslambda'].add_response(
+        'get_function',
+        {'Configuration': {'FunctionArn': FUNCTION_ARN}},
+        {'FunctionName': 'Lambder-foo'}
+    )
+
+    with pytest.raises(Exception) as e:
+        loop.run_until_complete(
+            lambder.deploy_function('foo', 'bucket', '30', 128, 'd', {})
+        )
+
+    assert 'AccessDenied' in str(e.value)
+    assert len(zfiles) == 1 and not os.path.exists(zfiles[0])
@@ -0,0 +1,228 @@
+import botocore.exceptions
+import json
+import pytest
+from botocore.stub import Stubber
+from lambder.lambder import Lambder, LambderBase
+
+FUNCTION_ARN = 'arn:aws:lambda:us-east-1:123456789012:function:Lambder-foo'
+ALIAS_ARN = FUNCTION_ARN + ':live'
+RULE_ARN = 'arn:aws:events:us-east-1:123456789012:rule/Lambder-nightly'
+
+
+def prepare(doc):
+    return LambderBase()._prepare_events(json.dumps(doc))
+
+
+def event(**fields):
+    entry = {'name': 'nightly', 'cron': 'rate(1 day)', 'function_name': 'foo'}
+    entry.update(fields)
+    return entry
+
+
+def test_prepare_plain_list():
+    entries = prepare([event(input_event={'b': 1, 'a': [1, 2]})])
+
+    assert entries == [{
+        'name': 'nightly',
+        'cron': 'rate(1 day)',
+        'function_name': 'foo',
+        'enabled': True,
+        'input_s3': None,
+        'input_json': '{"a":[1,2],"b":1}'
+    }]
+
+
+def test_prepare_templates_and_s3():
+    entries = prepare({
+        'templates': {'stop': {'ids': '${ids}', 'tag': 'env-${env}'}},
+        'events': [
+            event(
+                input_template='stop',
+                input_vars={'ids': ['i-1', 'i-2'], 'env': 'dev'}
+            ),
+            event(name='big', input_s3='s3://bucket/path/to/key.json')
+        ]
+    })
+
+    assert json.loads(entries[0]['input_json']) == {
+        'ids': ['i-1', 'i-2'],
+        'tag': 'env-dev'
+    }
+    assert json.loads(entries[1]['input_json']) == {
+        'input_s3': {'bucket': 'bucket', 'key': 'path/to/key.json'}
+    }
+
+
+def test_prepare_reports_every_problem():
+    with pytest.raises(ValueError) as e:
+        prepare({
+            'templates': {'t': {}},
+            'events': [
+                'not an object',
+                {'cron': 'rate(1 day)'},
+                event(name='a', input_template=['t']),
+                event(name='b', input_template='missing'),
+                event(name='c', input_s3='bucket/key'),
+                event(name='d', input_template='t', input_vars=[1]),
+                event(name=5),
+                event(name='e', cron=None),
+                event(name='f', function_name=['foo']),
+                event(name='g', input_s3=5)
+            ]
+        })
+
+    lines = str(e.value).splitlines()
+    assert lines[0] == 'invalid events:'
+    assert lines[1:] == [
+        '  #0: event must be an object',
+        "  #1: missing 'name'",
+        '  a: input_template must be a template name',
+        '  b: unknown template missing',
+        '  c: input_s3 must look like s3://bucket/key',
+        '  d: input_vars must be an object',
+        '  #6: name must be a string',
+        '  e: cron must be a string',
+        '  f: function_name must be a string',
+        '  g: input_s3 must look like s3://bucket/key'
+    ]
+
+
+def test_render():
+    base = LambderBase()
+    variables = {'ids': [1, 2], 'env': 'dev', 'n': 3}
+
+    assert base._render(
+        {'ids': '${ids}', 'tag': 'env-${env}-${n}', 'keep': [7, None]},
+        variables
+    ) == {'ids': [1, 2], 'tag': 'env-dev-3', 'keep': [7, None]}
+    assert base._render('$.detail', variables) == '$.detail'
+    assert base._render('cost $5 ${env}', variables) == 'cost $5 dev'
+
+
+def test_render_uses_json_inside_longer_strings():
+    base = LambderBase()
+    variables = {'f': True, 'n': None, 'ids': ['a'], 'o': {'b': 1}}
+
+    assert base._render('x-${f}-${n}', variables) == 'x-true-null'
+    assert base._render('ids=${ids} o=${o}', variables) == 'ids=["a"] o={"b":1}'
+    assert base._render('${f}', variables) is True
+
+
+def test_render_reports_unknown_placeholder():
+    with pytest.raises(ValueError) as e:
+        LambderBase()._render({'a': ['${nope}']}, {})
+    assert str(e.value) == 'no value for ${nope}'
+
+
+def test_check_limits():
+    base = LambderBase()
+    entry = {
+        'name': 'n' * 64,
+        'cron': 'c' * 257,
+        'input_json': 'i' * 8193
+    }
+
+    problems = base._check_limits(entry)
+
+    assert len(problems) == 3
+    assert problems[0].startswith('rule name Lambder-nnn')
+    assert 'cron is longer than 256' in problems[1]
+    assert 'consider input_s3' in problems[2]
+    assert base._check_limits(dict(entry, name='n', cron='c', input_json='{}')) == []
+
+
+@pytest.fixture
+def lambder(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    return Lambder(region='us-east-1')
+
+
+def stub_add_event(lambder, targets):
+    awslambda = Stubber(lambder.awslambda)
+    events = Stubber(lambder.events)
+    events.add_response(
+        'put_rule',
+        {'RuleArn': RULE_ARN},
+        {
+            'Name': 'Lambder-nightly',
+            'ScheduleExpression': 'rate(1 day)',
+            'State': 'ENABLED'
+        }
+    )
+    awslambda.add_response(
+        'get_alias',
+        {'AliasArn': ALIAS_ARN},
+        {'FunctionName': 'foo', 'Name': 'live'}
+    )
+    awslambda.add_client_error(
+        'add_permission',
+        'ResourceConflictException'
+    )
+    events.add_response(
+        'list_targets_by_rule',
+        {'Targets': targets},
+        {'Rule': 'Lambder-nightly'}
+    )
+    return awslambda, events
+
+
+def test_add_event_skips_unchanged_target(lambder):
+    awslambda, events = stub_add_event(
+        lambder,
+        [{'Id': 'nightly', 'Arn': ALIAS_ARN, 'Input': '{"a":1}'}]
+    )
+
+    with awslambda, events:
+        lambder.add_event('nightly', 'foo', 'rate(1 day)', {'a': 1})
+        events.assert_no_pending_responses()
+
+
+def test_add_event_puts_changed_target(lambder):
+    awslambda, events = stub_add_event(
+        lambder,
+        [{'Id': 'nightly', 'Arn': ALIAS_ARN, 'Input': '{"a":0}'}]
+    )
+    events.add_response(
+        'put_targets',
+        {'FailedEntryCount': 0},
+        {
+            'Rule': 'Lambder-nightly',
+            'Targets': [{'Id': 'nightly', 'Arn': ALIAS_ARN, 'Input': '{"a":1}'}]
+        }
+    )
+
+    with awslambda, events:
+        lambder.add_event('nightly', 'foo', 'rate(1 day)', {'a': 1})
+        events.assert_no_pending_responses()
+
+
+def test_check_s3_inputs_reports_missing_objects(lambder, monkeypatch):
+    s3 = lambder.session.client('s3')
+    monkeypatch.setattr(lambder.session, 'client', lambda service: s3)
+    with Stubber(s3) as stubber:
+        stubber.add_client_error('head_object', '404', http_status_code=404)
+        stubber.add_response(
+            'head_object',
+            {},
+            {'Bucket': 'bucket', 'Key': 'there.json'}
+        )
+
+        with pytest.raises(ValueError) as e:
+            lambder._check_s3_inputs([
+                {'input_s3': 's3://bucket/there.json'},
+                {'input_s3': 's3://bucket/gone.json'},
+                {'input_s3': None}
+            ])
+
+    assert str(e.value) == 'input_s3 objects not found:\n  s3://bucket/gone.json'
+
+
+def test_check_s3_inputs_raises_other_errors(lambder, monkeypatch):
+    s3 = lambder.session.client('s3')
+    monkeypatch.setattr(lambder.session, 'client', lambda service: s3)
+    with Stubber(s3) as stubber:
+        stubber.add_client_error('head_object', '403', http_status_code=403)
+
+        with pytest.raises(botocore.exceptions.ClientError):
+            lambder._check_s3_inputs([{'input_s3': 's3://bucket/key.json'}])
@@ -0,0 +1,143 @@
+import os
+import pytest
+from lambder.lambder import LambderBase, LambderGroup
+
+
+class StubMember(LambderBase):
+    # Records the AWS calls LambderGroup makes on a member
+    def __init__(self, region, profile=None, fail=()):
+        self.region = region
+        self.profile = profile
+        self.fail = fail
+        self.calls = []
+
+    def _record(self, *call):
+        self.calls.append(call)
+        if call[0] in self.fail:
+            raise RuntimeError('{} failed in {}'.format(call[0], self.region))
+
+    def _s3_cp(self, src, bucket, key):
+        assert os.path.exists(src)
+        self._record('upload', bucket)
+
+    def _s3_copy(self, src_bucket, key, bucket):
+        self._record('copy', src_bucket, bucket)
+
+    def deploy_role(self, name, vpc_config):
+        self._record('role')
+        return 'role-' + str(self.profile)
+
+    def deploy_function(self, name, bucket, *args, **kwargs):
+        self._record('deploy', bucket, kwargs['role'])
+        return '1'
+
+    def delete_function(self, name, bucket, delete_role=True):
+        self._record('delete', bucket, delete_role)
+
+    def _delete_lambda_role(self, name):
+        self._record('delete_role')
+
+
+def group_of(*members):
+    group = LambderGroup(
+        regions=list(dict.fromkeys(m.region for m in members)),
+        profiles=list(dict.fromkeys(m.profile for m in members))
+    )
+    group._members = list(members)
+    return group
+
+
+@pytest.fixture
+def project(tmpdir, monkeypatch):
+    tmpdir.join('lambda', 'foo', 'foo.py').write('x = 1\n', ensure=True)
+    monkeypatch.chdir(tmpdir)
+    return tmpdir
+
+
+def test_map_captures_errors_in_order():
+    east = StubMember('us-east-1')
+    west = StubMember('us-west-2', fail=['delete_role'])
+    group = group_of(east, west)
+
+    results = group.map(lambda m: m._delete_lambda_role('foo') or m.region)
+
+    assert [r.lambder for r in results] == [east, west]
+    assert results[0].value == 'us-east-1' and results[0].error is None
+    assert isinstance(results[1].error, RuntimeError)
+    assert results[1].label == 'default/us-west-2'
+
+
+def test_bucket_for():
+    group = LambderGroup()
+    member = StubMember('eu-west-1')
+    assert group.bucket_for(member, 'code-{region}') == 'code-eu-west-1'
+    assert group.bucket_for(member, 'code') == 'code'
+
+
+def test_check_bucket_needs_region_for_several_regions():
+    group = group_of(StubMember('us-east-1'), StubMember('us-west-2'))
+    with pytest.raises(ValueError):
+        group.check_bucket('code')
+    group.check_bucket('code-{region}')
+
+    group_of(StubMember('us-east-1', 'a'), StubMember('us-east-1', 'b'))\
+        .check_bucket('code')
+
+
+def test_distribute_seeds_once_per_profile_and_copies_the_rest(project):
+    a_east = StubMember('us-east-1', 'a')
+    a_west = StubMember('us-west-2', 'a')
+    b_east = StubMember('us-east-1', 'b')
+    b_west = StubMember('us-west-2', 'b')
+    group = group_of(a_east, a_west, b_east, b_west)
+
+    s3_key, bucket_of = group._distribute_package('foo', 'code-{region}')
+
+    assert a_east.calls == [('upload', 'code-us-east-1')]
+    assert a_west.calls == [('copy', 'code-us-east-1', 'code-us-west-2')]
+    assert b_east.calls == [('upload', 'code-us-east-1')]
+    assert b_west.calls == [('copy', 'code-us-east-1', 'code-us-west-2')]
+    assert bucket_of(b_west) == 'code-us-west-2'
+    assert s3_key.startswith('lambder/lambdas/foo_lambda-')
+
+
+def test_distribute_reports_failed_seed_for_its_copies(project):
+    east = StubMember('us-east-1', fail=['upload'])
+    west = StubMember('us-west-2')
+    group = group_of(east, west)
+
+    s3_key, bucket_of = group._distribute_package('foo', 'code-{region}')
+
+    assert west.calls == []
+    for member in (east, west):
+        with pytest.raises(RuntimeError):
+            bucket_of(member)
+
+
+def test_deploy_sets_up_role_once_per_profile(project):
+    a_east = StubMember('us-east-1', 'a')
+    a_west = StubMember('us-west-2', 'a')
+    b_east = StubMember('us-east-1', 'b')
+    group = group_of(a_east, a_west, b_east)
+
+    results = group.deploy_function('foo', 'code-{region}', 3, 128, 'd', {})
+
+    assert [r.value for r in results] == ['1', '1', '1']
+    assert ('role',) in a_east.calls and ('role',) not in a_west.calls
+    assert ('deploy', 'code-us-west-2', 'role-a') in a_west.calls
+    assert ('deploy', 'code-us-east-1', 'role-b') in b_east.calls
+
+
+def test_delete_removes_role_once_after_functions():
+    east = StubMember('us-east-1', 'a')
+    west = StubMember('us-west-2', 'a')
+    group = group_of(east, west)
+
+    results = group.delete_function('foo', 'code-{region}')
+
+    assert not any(r.error for r in results)
+    assert east.calls == [
+        ('delete', 'code-us-east-1', False),
+        ('delete_role',)
+    ]
+    assert west.calls == [('delete', 'code-us-west-2', False)]
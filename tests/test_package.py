@@ -0,0 +1,120 @@
+import zipfile
+import pytest
+from lambder.lambder import LambderBase
+
+
+@pytest.fixture
+def project(tmpdir, monkeypatch):
+    code = tmpdir.join('lambda', 'foo')
+    code.join('foo.py').write('import pkg\n', ensure=True)
+    code.join('README.md').write('# foo\n')
+    code.join('tests', 'test_foo.py').write('x = 1\n', ensure=True)
+    code.join('__pycache__', 'foo.cpython-311.pyc').write('x', ensure=True)
+    code.join('pkg', '__init__.py').write('from pkg import testing\n', ensure=True)
+    code.join('pkg', 'testing', '__init__.py').write('x = 1\n', ensure=True)
+    code.join('pkg', 'docs', 'index.rst').write('docs\n', ensure=True)
+    code.join('pkg-1.0.dist-info', 'METADATA').write('x = 1\n', ensure=True)
+    monkeypatch.chdir(tmpdir)
+    return code
+
+
+def zipped_names(base, path, categories):
+    zfile = str(path.dirpath().join('out.zip'))
+    base._zipdir(zfile, str(path), categories)
+    with zipfile.ZipFile(zfile) as z:
+        return sorted(n.lstrip('/') for n in z.namelist())
+
+
+def test_prune_category():
+    base = LambderBase()
+    assert base._prune_category('tests/test_foo.py') == 'tests'
+    assert base._prune_category('README.md') == 'docs'
+    assert base._prune_category('pkg/__pycache__/x.pyc') == 'caches'
+    assert base._prune_category('pkg/testing/__init__.py') == 'vendored-tests'
+    assert base._prune_category('pkg/README.md') == 'vendored-docs'
+    assert base._prune_category('pkg/testing/__init__.py', ['tests']) is None
+    assert base._prune_category('pkg/core.py') is None
+
+
+def test_zipdir_safe_keeps_vendored_packages(project):
+    base = LambderBase()
+    names = zipped_names(base, project, base._prune_categories('safe'))
+
+    assert names == [
+        'foo.py',
+        'pkg-1.0.dist-info/METADATA',
+        'pkg/__init__.py',
+        'pkg/docs/index.rst',
+        'pkg/testing/__init__.py',
+    ]
+
+
+def test_zipdir_strict(project):
+    base = LambderBase()
+    names = zipped_names(base, project, base._prune_categories('strict'))
+
+    assert names == ['foo.py', 'pkg/__init__.py']
+
+
+def test_zipdir_without_prune_keeps_everything(project):
+    names = zipped_names(LambderBase(), project, ())
+    assert len(names) == 8
+
+
+def test_unknown_prune_profile():
+    with pytest.raises(ValueError):
+        LambderBase()._prune_categories('all')
+
+
+def test_missing_lambda_dir(project):
+    base = LambderBase()
+    for check in [base.analyze_package, base._package, base._time_import]:
+        with pytest.raises(ValueError) as e:
+            check('fooo')
+        assert 'lambda/fooo does not exist' in str(e.value)
+
+
+def test_analyze_package(project):
+    project.join('copy.py').write('import pkg\n')
+
+    report = LambderBase().analyze_package('foo', prune='safe')
+
+    assert report['files'] == 9
+    assert report['by_dir']['pkg'][0] == 3
+    assert report['by_type']['.py'][0] == 5
+    assert report['flagged'] == {
+        'tests': [1, 6],
+        'docs': [1, 6],
+        'caches': [1, 1],
+        'metadata': [1, 6],
+        'vendored-tests': [1, 6],
+        'vendored-docs': [1, 5],
+    }
+    assert [sorted(paths) for paths in report['duplicates']] == [
+        [
+            'pkg-1.0.dist-info/METADATA',
+            'pkg/testing/__init__.py',
+            'tests/test_foo.py'
+        ],
+        ['copy.py', 'foo.py'],
+    ]
+    assert isinstance(report['import_time'], float)
+    assert report['pruned_zipped'] < report['zipped']
+
+
+def test_time_import_ignores_output(project):
+    project.join('foo.py').write('print("hello")\nprint(1.5)\n')
+    assert isinstance(LambderBase()._time_import('foo'), float)
+
+
+def test_time_import_reports_errors(project):
+    project.join('foo.py').write('import nope\n')
+    assert 'nope' in LambderBase()._time_import('foo')
+
+
+def test_time_import_times_out(project):
+    project.join('foo.py').write(
+        'import sys, time\nsys.stderr.write("waiting\\n")\ntime.sleep(30)\n'
+    )
+    assert LambderBase()._time_import('foo', timeout=0.5) == \
+        'import did not finish in 0.5s'
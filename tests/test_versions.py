@@ -0,0 +1,168 @@
+import pytest
+from botocore.stub import Stubber
+from lambder.lambder import Lambder
+
+FUNCTION_ARN = 'arn:aws:lambda:us-east-1:123456789012:function:Lambder-foo'
+ALIAS_ARN = FUNCTION_ARN + ':live'
+
+
+@pytest.fixture
+def lambder(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    return Lambder(region='us-east-1')
+
+
+@pytest.fixture
+def awslambda(lambder):
+    with Stubber(lambder.awslambda) as stubber:
+        yield stubber
+        stubber.assert_no_pending_responses()
+
+
+@pytest.fixture
+def events(lambder):
+    with Stubber(lambder.events) as stubber:
+        yield stubber
+        stubber.assert_no_pending_responses()
+
+
+def stub_versions(awslambda, live, versions):
+    awslambda.add_response(
+        'get_alias',
+        {'FunctionVersion': live},
+        {'FunctionName': 'Lambder-foo', 'Name': 'live'}
+    )
+    awslambda.add_response(
+        'list_versions_by_function',
+        {'Versions': [{'Version': v} for v in versions]},
+        {'FunctionName': 'Lambder-foo'}
+    )
+
+
+def stub_set_alias(awslambda, version):
+    awslambda.add_response(
+        'update_alias',
+        {'AliasArn': ALIAS_ARN, 'FunctionVersion': version},
+        {'FunctionName': 'Lambder-foo', 'Name': 'live', 'FunctionVersion': version}
+    )
+
+
+def stub_no_rules(events):
+    events.add_response(
+        'list_rule_names_by_target',
+        {'RuleNames': []},
+        {'TargetArn': FUNCTION_ARN}
+    )
+
+
+def test_parse_function_arn(lambder):
+    assert lambder._parse_function_arn(FUNCTION_ARN) == ('Lambder-foo', None)
+    assert lambder._parse_function_arn(ALIAS_ARN) == ('Lambder-foo', 'live')
+
+
+def test_s3_prefix_does_not_match_other_functions(lambder):
+    prefix = lambder._s3_prefix('foo')
+    assert lambder._s3_key('foo', 'abc').startswith(prefix)
+    assert not lambder._s3_key('foo_lambda2', 'abc').startswith(prefix)
+    assert not lambder._legacy_s3_key('foo_lambda2').startswith(prefix)
+
+
+def test_rollback_defaults_to_previous_version(lambder, awslambda, events):
+    stub_versions(awslambda, '5', ['$LATEST', '6', '3', '5', '4'])
+    stub_set_alias(awslambda, '4')
+    stub_no_rules(events)
+
+    assert lambder.rollback_function('foo') == '4'
+
+
+def test_rollback_to_given_version(lambder, awslambda, events):
+    stub_set_alias(awslambda, '2')
+    stub_no_rules(events)
+
+    assert lambder.rollback_function('foo', '2') == '2'
+
+
+def test_rollback_without_older_version(lambder, awslambda):
+    stub_versions(awslambda, '1', ['$LATEST', '1', '2'])
+
+    with pytest.raises(ValueError):
+        lambder.rollback_function('foo')
+
+
+def test_retarget_moves_unqualified_targets(lambder, awslambda, events):
+    events.add_response(
+        'list_rule_names_by_target',
+        {'RuleNames': ['Lambder-nightly', 'SomeoneElses']},
+        {'TargetArn': FUNCTION_ARN}
+    )
+    rule_arn = 'arn:aws:events:us-east-1:123456789012:rule/Lambder-nightly'
+    events.add_response(
+        'describe_rule',
+        {'Arn': rule_arn},
+        {'Name': 'Lambder-nightly'}
+    )
+    awslambda.add_response(
+        'add_permission',
+        {'Statement': '{}'},
+        {
+            'FunctionName': 'Lambder-foo',
+            'StatementId': 'Lambder-fooRulePermission',
+            'Action': 'lambda:InvokeFunction',
+            'Principal': 'events.amazonaws.com',
+            'SourceArn': rule_arn,
+            'Qualifier': 'live'
+        }
+    )
+    events.add_response(
+        'list_targets_by_rule',
+        {'Targets': [{'Id': 'nightly', 'Arn': FUNCTION_ARN, 'Input': '{}'}]},
+        {'Rule': 'Lambder-nightly'}
+    )
+    events.add_response(
+        'put_targets',
+        {'FailedEntryCount': 0},
+        {
+            'Rule': 'Lambder-nightly',
+            'Targets': [{'Id': 'nightly', 'Arn': ALIAS_ARN, 'Input': '{}'}]
+        }
+    )
+
+    assert lambder._retarget_events(ALIAS_ARN) == ['Lambder-nightly']
+
+
+def test_update_waits_before_publishing(lambder, awslambda):
+    waited = {'FunctionName': 'Lambder-foo'}
+    awslambda.add_response(
+        'update_function_code',
+        {'CodeSha256': 'abc'},
+        {'FunctionName': 'Lambder-foo', 'S3Bucket': 'bucket', 'S3Key': 'k'}
+    )
+    awslambda.add_response(
+        'get_function_configuration',
+        {'LastUpdateStatus': 'Successful'},
+        waited
+    )
+    awslambda.add_response(
+        'update_function_configuration',
+        {'CodeSha256': 'abc'},
+        {
+            'FunctionName': 'Lambder-foo',
+            'Timeout': 30,
+            'MemorySize': 128,
+            'Description': 'd',
+            'VpcConfig': {}
+        }
+    )
+    awslambda.add_response(
+        'get_function_configuration',
+        {'LastUpdateStatus': 'Successful'},
+        waited
+    )
+    awslambda.add_response(
+        'publish_version',
+        {'Version': '7'},
+        {'FunctionName': 'Lambder-foo', 'CodeSha256': 'abc'}
+    )
+
+    assert lambder._update_lambda('foo', 'bucket', 'k', 30, 128, 'd', {}) == '7'
@@ -0,0 +1,59 @@
+import threading
+import time
+from lambder.lambder import Watcher
+
+
+def edit_later(edits):
+    # apply (delay, path, contents) edits from a background thread
+    def run():
+        for delay, path, contents in edits:
+            time.sleep(delay)
+            path.write(contents, ensure=True)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_changes_are_debounced_into_one_batch(tmpdir):
+    code = tmpdir.join('lambda', 'foo')
+    code.join('foo.py').write('a', ensure=True)
+    policy = tmpdir.join('iam', 'policy.json')
+    policy.write('{}', ensure=True)
+
+    watcher = Watcher([str(code), str(policy)], interval=0.02, debounce=0.2)
+    changes = watcher.changes()
+    thread = edit_later([
+        (0.1, code.join('foo.py'), 'bb'),
+        (0.05, code.join('bar.py'), 'c'),
+        (0.05, policy, '{"a": 1}'),
+    ])
+
+    started = time.time()
+    assert next(changes) == set([str(code), str(policy)])
+    assert time.time() - started >= 0.2 + 0.2
+    thread.join()
+
+
+def test_excluded_files_do_not_trigger(tmpdir):
+    code = tmpdir.join('lambda', 'foo')
+    code.join('foo.py').write('a', ensure=True)
+    policy = tmpdir.join('iam', 'policy.json')
+    policy.write('{}', ensure=True)
+
+    watcher = Watcher(
+        [str(code), str(policy)],
+        exclude=['__pycache__', '*.pyc'],
+        interval=0.02,
+        debounce=0.1
+    )
+    changes = watcher.changes()
+    thread = edit_later([
+        (0.1, code.join('__pycache__', 'foo.cpython-311.pyc'), 'x'),
+        (0.05, code.join('.foo.py.swp'), 'x'),
+        (0.05, code.join('foo.py~'), 'x'),
+        (0.2, policy, '{"a": 1}'),
+    ])
+
+    assert next(changes) == set([str(policy)])
+    thread.join()